@@ -0,0 +1,179 @@
+'''
+Headless batch analysis of csv spectra. Imports neither Qt nor matplotlib, so it runs unattended on analysis servers:
+    python batch.py sweeps/ shift --reference sweeps/25C.csv --window 1490 1492 -o shifts.csv
+'''
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from import_cache import import_cache
+from preprocess import FILTERS, Preprocessing
+from spectra import fit_cosine, temperature_shift, calculate_FSR, find_resonances, fit_resonances
+from spectrum import Spectrum
+
+def find_files(patterns):
+    '''
+    Expands directories and glob patterns into a sorted list of csv files.
+    '''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(glob.glob(os.path.join(pattern, '*.csv')))
+        else:
+            files.extend(glob.glob(pattern))
+    return sorted(set(files))
+
+def fit_file(path, start, stop, cache):
+    spectrum = Spectrum.from_csv(path, cache=cache)
+    result = fit_cosine(spectrum.wavelength, spectrum.normalized, start, stop)
+    amplitude, argument = result.parameters
+    return {'amplitude': amplitude, 'argument': argument, 'period_nm': 2 * np.pi / argument,
+            'residual': result.residual, 'nfev': result.nfev}
+
+def shift_file(path, reference, start, end, method, preprocessing=None):
+    #Paths are streamed, so only the window is held in memory
+    result = temperature_shift(reference, path, start, end, method=method, preprocessing=preprocessing)
+    return {'reference': reference, 'minimum_reference_nm': result.minimum1, 'minimum_nm': result.minimum2,
+            'shift_nm': result.shift}
+
+def fsr_file(path, peak1, peak2, preprocessing=None):
+    result = calculate_FSR(path, *peak1, *peak2, preprocessing=preprocessing)
+    return {'peak1_nm': result.peak1, 'peak2_nm': result.peak2, 'FSR_nm': result.FSR}
+
+def resonance_file(path, prominence, min_width, kind, cache, model=None, preprocessing=None):
+    spectrum = Spectrum.from_csv(path, cache=cache)
+    result = find_resonances(spectrum, prominence=prominence, min_width=min_width, kind=kind,
+                             preprocessing=preprocessing)
+    has_FSR = len(result.FSR) > 0
+    row = {'resonances': len(result.positions),
+           'mean_FSR_nm': np.mean(result.FSR) if has_FSR else np.nan,
+           'std_FSR_nm': np.std(result.FSR) if has_FSR else np.nan,
+           'mean_extinction_ratio_dB': np.mean(result.extinction_ratio) if len(result.positions) else np.nan,
+           'mean_width_nm': np.mean(result.widths) if len(result.positions) else np.nan}
+    if model is not None:
+        fit = fit_resonances(spectrum, model, prominence=prominence, kind=kind, preprocessing=preprocessing)
+        converged = fit.converged
+        row.update({'fitted': int(np.count_nonzero(converged)),
+                    'median_linewidth_nm': np.median(fit.linewidths[converged]) if converged.any() else np.nan,
+                    'median_Q': np.median(fit.Q[converged]) if converged.any() else np.nan})
+    return row
+
+def run_file(job, path):
+    '''
+    Runs one analysis on one file. Failures are recorded in the results instead of stopping the batch.
+    '''
+    try:
+        row = job(path)
+        row['error'] = ''
+    except Exception as error:
+        row = {'error': f'{type(error).__name__}: {error}'}
+    return {'file': path, **row}
+
+def run_batch(files, job, workers=None):
+    '''
+    Runs job over every file on a process pool and returns one DataFrame row per file, in input order.
+    '''
+    run = partial(run_file, job)
+    if workers == 1:
+        rows = [run(path) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(executor.map(run, files))
+    return pd.DataFrame(rows)
+
+def parquet_engine():
+    '''
+    Returns the name of an installed parquet engine, or None if neither pandas engine is installed.
+    '''
+    for engine in ('pyarrow', 'fastparquet'):
+        if importlib.util.find_spec(engine) is not None:
+            return engine
+    return None
+
+def write_results(results, output):
+    if output is None:
+        results.to_csv(sys.stdout, index=False)
+    elif output.endswith('.parquet'):
+        results.to_parquet(output, index=False, engine=parquet_engine())
+    else:
+        results.to_csv(output, index=False)
+
+def build_parser():
+    #Options shared by every analysis, so they can follow the analysis name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-o', '--output', help="results table, .csv or .parquet (default: csv on stdout)")
+    common.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: all cores)")
+    common.add_argument('--no-cache', action='store_true', help="do not read or write binary import sidecars")
+    common.add_argument('--filter', choices=FILTERS, default='none',
+                        help="smooth spectra before peak search (not used by fit)")
+    common.add_argument('--filter-window', type=int, default=11, help="filter length (samples)")
+    common.add_argument('--filter-order', type=int, default=3, help="Savitzky-Golay polynomial order")
+    common.add_argument('--cutoff', type=float, default=0.1, help="FIR cutoff as a fraction of the Nyquist frequency")
+    common.add_argument('--baseline', type=int, default=None, metavar='ORDER',
+                        help="remove a polynomial baseline of this order before peak search")
+
+    parser = argparse.ArgumentParser(description="Run spectral analyses over many csv files without a GUI.")
+    parser.add_argument('inputs', nargs='+', help="csv files, directories or glob patterns")
+    analyses = parser.add_subparsers(dest='analysis', required=True)
+
+    fit = analyses.add_parser('fit', parents=[common], help="cosine curve fit")
+    fit.add_argument('--start', type=float, default=0, help="lowest cosine argument to consider (rad/nm)")
+    fit.add_argument('--stop', type=float, default=0, help="highest cosine argument to consider (rad/nm)")
+
+    shift = analyses.add_parser('shift', parents=[common], help="temperature shift of a resonance against a reference spectrum")
+    shift.add_argument('--reference', help="reference spectrum (default: first input file)")
+    shift.add_argument('--window', type=float, nargs=2, required=True, metavar=('START', 'END'))
+    shift.add_argument('--method', choices=['minimum', 'xcorr'], default='minimum',
+                       help="lowest sample in the window or FFT cross-correlation")
+
+    fsr = analyses.add_parser('fsr', parents=[common], help="free spectral range between two peaks")
+    fsr.add_argument('--peak1', type=float, nargs=2, required=True, metavar=('START', 'END'))
+    fsr.add_argument('--peak2', type=float, nargs=2, required=True, metavar=('START', 'END'))
+
+    resonances = analyses.add_parser('resonances', parents=[common], help="detect every resonance and summarize FSR")
+    resonances.add_argument('--prominence', type=float, default=3, help="minimum extinction ratio (dB)")
+    resonances.add_argument('--min-width', type=float, default=None, help="minimum resonance width (nm)")
+    resonances.add_argument('--kind', choices=['dip', 'peak'], default='dip')
+    resonances.add_argument('--model', choices=['lorentzian', 'airy'], default=None,
+                            help="also fit every resonance with this model and report linewidth and Q")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    #Checked before any file is analyzed, a missing engine would otherwise only show once every result is computed
+    if args.output is not None and args.output.endswith('.parquet') and parquet_engine() is None:
+        parser.error("writing .parquet needs pyarrow or fastparquet, install one or write .csv instead")
+    files = find_files(args.inputs)
+    if not files:
+        print("No csv files found", file=sys.stderr)
+        return 1
+
+    #The baseline follows the transmission away from what the analysis looks for: FSR peaks, shift minima
+    kind = {'resonances': getattr(args, 'kind', 'dip'), 'fsr': 'peak'}.get(args.analysis, 'dip')
+    preprocessing = Preprocessing(args.filter, args.filter_window, args.filter_order, args.cutoff, args.baseline, kind)
+    if args.analysis == 'fit':
+        job = partial(fit_file, start=args.start, stop=args.stop,
+                      cache=None if args.no_cache else import_cache)
+    elif args.analysis == 'shift':
+        reference = args.reference or files[0]
+        job = partial(shift_file, reference=reference, start=args.window[0], end=args.window[1],
+                      method=args.method, preprocessing=preprocessing)
+    elif args.analysis == 'fsr':
+        job = partial(fsr_file, peak1=tuple(args.peak1), peak2=tuple(args.peak2), preprocessing=preprocessing)
+    else:
+        job = partial(resonance_file, prominence=args.prominence, min_width=args.min_width, kind=args.kind,
+                      cache=None if args.no_cache else import_cache, model=args.model, preprocessing=preprocessing)
+
+    write_results(run_batch(files, job, args.workers), args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+'''
+Checks the shift estimates against synthetic ring and MZI spectra with known shifts. Periodic spectra correlate equally
+well at every multiple of their FSR, so a shift estimate that locks onto the wrong period shows up here as an error of a
+whole FSR.
+
+Run from the repository root with: python -m benchmarks.accuracy
+'''
+import sys
+
+from spectra import estimate_shift, estimate_shifts, temperature_shift
+from synthetic import mzi_spectrum, ring_spectrum
+
+POINTS = 100_000
+
+#Largest accepted error of an estimated shift (nm)
+TOLERANCE = 0.005
+
+def cases():
+    '''
+    Yields (name, true shift, estimated shift) for every checked estimate.
+    '''
+    for generator, FSR in ((ring_spectrum, 2.0), (mzi_spectrum, 3.0)):
+        name = generator.__name__
+        for seed in range(3):
+            for shift in (0.01, 0.037, -0.2, 0.4 * FSR):
+                reference = generator(POINTS, seed=seed)
+                shifted = generator(POINTS, shift=shift, seed=seed + 100)
+                yield f'{name} whole sweep, seed {seed}', shift, estimate_shift(reference, shifted)
+                yield (f'{name} 1486-1494 nm, seed {seed}', shift,
+                       temperature_shift(reference, shifted, 1486, 1494, method='xcorr').shift)
+
+        #One reference shared by a batch of spectra
+        reference = generator(POINTS, seed=0)
+        shifts = [0.0, 0.01, 0.02, 0.05]
+        estimates = estimate_shifts([reference], [generator(POINTS, shift=shift, seed=index + 1)
+                                                  for index, shift in enumerate(shifts)])
+        for shift, estimate in zip(shifts, estimates):
+            yield f'{name} batch', shift, estimate
+
+def main():
+    failures = 0
+    print(f'{"case":>36} {"true (nm)":>10} {"estimate (nm)":>14}')
+    for name, shift, estimate in cases():
+        failed = abs(estimate - shift) > TOLERANCE
+        failures += failed
+        print(f'{name:>36} {shift:>10.4f} {estimate:>14.4f}{" FAILED" if failed else ""}')
+    print(f'\n{failures} failed')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+'''
+Compares the cost of repeatedly accessing wavelength, linear and normalized power through the old DataFrame pattern
+against the cached Spectrum views.
+
+Run from the repository root with: python -m benchmarks.spectrum_conversion
+'''
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from spectrum import Spectrum
+from synthetic import mzi_spectrum
+
+def make_dataframe(points):
+    '''
+    Builds a DataFrame laid out like pd.read_csv(..., header=None) output, header row included.
+    '''
+    spectrum = mzi_spectrum(points, seed=0)
+    return pd.DataFrame({0: np.r_[np.nan, spectrum.wavelength], 1: np.r_[np.nan, spectrum.power]})
+
+def dataframe_access(data):
+    '''
+    What every analysis and dialog used to do on each call.
+    '''
+    dataX = np.array(data.iloc[1:][0])
+    dataY = np.array(data.iloc[1:][1])
+    dataY_linear = 10 ** (dataY / 10) * 1000
+    dataY_norm = (dataY_linear / np.max(dataY_linear)) * 2 - 1
+    return dataX, dataY_linear, dataY_norm
+
+def spectrum_access(spectrum):
+    return spectrum.wavelength, spectrum.linear, spectrum.normalized
+
+def main(sizes=(10_000, 100_000, 1_000_000), repeats=20):
+    print(f'{"points":>10} {"DataFrame (ms)":>15} {"Spectrum (ms)":>15} {"speedup":>10}')
+    for points in sizes:
+        data = make_dataframe(points)
+        spectrum = Spectrum.from_dataframe(data)
+        old = min(timeit.repeat(lambda: dataframe_access(data), number=1, repeat=repeats))
+        new = min(timeit.repeat(lambda: spectrum_access(spectrum), number=1, repeat=repeats))
+        print(f'{points:>10} {old * 1e3:>15.3f} {new * 1e3:>15.4f} {old / new:>10.0f}x')
+
+if __name__ == '__main__':
+    main()
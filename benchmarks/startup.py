@@ -0,0 +1,92 @@
+'''
+Measures application startup: the import time of main2 from python -X importtime, the wall time until the main window
+has been shown, and whether any of the modules that are meant to load lazily were imported at startup.
+
+Run from the repository root with:
+    python -m benchmarks.startup                    # report only
+    python -m benchmarks.startup --budget 1000      # also fail if the window takes longer than 1000 ms to show
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Modules that must only load on first use, not when the application starts
+DEFERRED = ('pandas', 'scipy', 'matplotlib.pyplot', 'qt_material')
+
+#Builds and shows the main window, then reports which deferred modules were imported on the way
+SHOW_WINDOW = f'''
+import sys
+from PyQt6.QtWidgets import QApplication
+import main2
+app = QApplication(sys.argv)
+window = main2.MainWindow()
+window.show()
+app.processEvents()
+print(','.join(name for name in {DEFERRED!r} if name in sys.modules))
+'''
+
+def environment():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return env
+
+def import_times():
+    '''
+    Returns the self and cumulative import time in ms of every module imported by main2, keyed by module name.
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main2'], cwd=ROOT, env=environment(),
+                             capture_output=True, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own) / 1000, int(cumulative) / 1000)
+    return times
+
+def time_to_window():
+    '''
+    Returns the wall time in ms from process start until the main window has been shown, and the deferred modules that
+    were imported by then.
+    '''
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-c', SHOW_WINDOW], cwd=ROOT, env=environment(), capture_output=True,
+                             text=True, check=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    loaded = process.stdout.strip().splitlines()[-1] if process.stdout.strip() else ''
+    return elapsed, [name for name in loaded.split(',') if name]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure application startup time.")
+    parser.add_argument('--repeat', type=int, default=5, help="number of cold starts, the fastest is reported")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument('--budget', type=float, default=None, help="fail if the window takes longer to show (ms)")
+    args = parser.parse_args(argv)
+
+    times = import_times()
+    print(f'import main2: {times["main2"][1]:.1f} ms')
+    print(f'{"module":<45} {"self (ms)":>10} {"cumulative (ms)":>16}')
+    slowest = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (own, cumulative) in slowest[1:args.top + 1]:
+        print(f'{name:<45} {own:>10.1f} {cumulative:>16.1f}')
+
+    runs = [time_to_window() for _ in range(args.repeat)]
+    elapsed = min(run[0] for run in runs)
+    loaded = sorted(set(name for run in runs for name in run[1]))
+    print(f'\nwindow shown after {elapsed:.0f} ms (fastest of {args.repeat})')
+
+    failed = False
+    if loaded:
+        print(f'FAIL: imported at startup: {", ".join(loaded)}')
+        failed = True
+    if args.budget is not None and elapsed > args.budget:
+        print(f'FAIL: startup exceeds the {args.budget:.0f} ms budget')
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+'''
+Times the main analysis paths on synthetic MZI and ring spectra, records peak memory, and compares each run against a
+stored baseline.
+
+Run from the repository root with:
+    python -m benchmarks.suite                      # all sizes, compare against benchmarks/baseline.json if present
+    python -m benchmarks.suite --sizes 10000 100000 --save-baseline
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from import_cache import ImportCache
+from lod import LODLine
+from preprocess import Preprocessing, preprocess
+from result_cache import result_cache
+from spectra import spectral_curve_fit, temperature_shift, calculate_FSR, find_resonances, fit_resonances
+from spectrum import Spectrum
+from stack import SpectrumStack
+from synthetic import mzi_spectrum, ring_spectrum, write_csv
+
+SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+def render(spectrum):
+    '''
+    Draws a spectrum the way MplCanvas does, without a window.
+    '''
+    figure = Figure(figsize=(5, 4), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    LODLine(figure.add_subplot(111), spectrum.wavelength, spectrum.power)
+    canvas.draw()
+
+def fresh(*spectra):
+    '''
+    Returns a function that copies spectra into new Spectrum objects, so every run starts without the linear,
+    normalized and content hash values cached on them.
+    '''
+    return lambda: tuple(Spectrum(spectrum.wavelength.copy(), spectrum.power.copy(), spectrum.label)
+                         for spectrum in spectra)
+
+def build_cases(points, directory):
+    '''
+    Returns (name, inputs, function) triples for one spectrum size. inputs builds the arguments of function outside the
+    timed part, and every function runs with a cleared result cache so repeated runs measure the computation, not the
+    cache.
+    '''
+    mzi = mzi_spectrum(points, seed=0)
+    mzi_shifted = mzi_spectrum(points, shift=0.1, seed=1)
+    ring = ring_spectrum(points, seed=0)
+    path = os.path.join(directory, f'mzi_{points}.csv')
+    write_csv(mzi, path)
+    sidecars = ImportCache(os.path.join(directory, 'cache'), max_bytes=2**40)
+    sidecars.load(path)
+
+    return [
+        ('import_csv', fresh(), lambda: Spectrum.from_csv(path, cache=None)),
+        ('import_sidecar', fresh(), lambda: Spectrum.from_csv(path, cache=sidecars).power.sum()),
+        ('curve_fit', fresh(mzi), lambda mzi: spectral_curve_fit(mzi, 0, 20)),
+        ('temperature_shift', fresh(mzi, mzi_shifted),
+         lambda mzi, mzi_shifted: temperature_shift(mzi, mzi_shifted, 1490, 1492)),
+        ('temperature_shift_xcorr', fresh(mzi, mzi_shifted),
+         lambda mzi, mzi_shifted: temperature_shift(mzi, mzi_shifted, 1488, 1496, method='xcorr', max_shift=1)),
+        ('FSR', fresh(mzi), lambda mzi: calculate_FSR(mzi, 1490, 1492, 1492.5, 1495)),
+        ('find_resonances', fresh(ring), lambda ring: find_resonances(ring)),
+        ('fit_resonances', fresh(ring), lambda ring: fit_resonances(ring, 'lorentzian')),
+        ('preprocess', fresh(ring), lambda ring: preprocess(ring, Preprocessing('savgol', 31, baseline=2))),
+        ('stack_shifts', fresh(mzi, mzi_shifted, ring),
+         lambda *spectra: SpectrumStack.from_spectra(spectra).shifts(1490, 1492)),
+        ('render', fresh(mzi), lambda mzi: render(mzi)),
+    ]
+
+def measure(inputs, fn, repeats):
+    '''
+    Returns the best wall time over repeats and the peak traced memory of one further run, in MB. Each run gets new
+    inputs.
+    '''
+    times = []
+    for _ in range(repeats):
+        result_cache.clear()
+        args = inputs()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+
+    result_cache.clear()
+    args = inputs()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak / 1024**2
+
+def run(sizes):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for points in sizes:
+            repeats = max(1, min(5, 2_000_000 // points))
+            for name, inputs, fn in build_cases(points, directory):
+                seconds, peak = measure(inputs, fn, repeats)
+                results.setdefault(name, {})[str(points)] = {'seconds': seconds, 'peak_mb': peak}
+                print(f'{name:>24} {points:>10} {seconds * 1e3:>12.2f} ms {peak:>10.1f} MB', flush=True)
+    return results
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints the ratio of each timing to the baseline and returns the cases that got slower than tolerance allows.
+    '''
+    regressions = []
+    print(f'\n{"case":>24} {"points":>10} {"baseline":>12} {"now":>12} {"ratio":>8}')
+    for name, sizes in results.items():
+        for points, now in sizes.items():
+            before = baseline.get(name, {}).get(points)
+            if before is None:
+                continue
+            ratio = now['seconds'] / before['seconds']
+            flag = ' SLOWER' if ratio > tolerance else ''
+            print(f'{name:>24} {points:>10} {before["seconds"] * 1e3:>9.2f} ms {now["seconds"] * 1e3:>9.2f} ms '
+                  f'{ratio:>7.2f}x{flag}')
+            if ratio > tolerance:
+                regressions.append((name, points, ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis paths on synthetic spectra.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="spectrum sizes in points")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline json file")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    print(f'{"case":>24} {"points":>10} {"time":>15} {"peak memory":>13}')
+    results = run(args.sizes)
+
+    if args.save_baseline:
+        #Merge so a partial run only replaces the sizes it measured
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        for name, sizes in results.items():
+            baseline.setdefault(name, {}).update(sizes)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('\nNo baseline to compare against, run with --save-baseline to create one')
+        return 0
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    if regressions:
+        print(f'\n{len(regressions)} case(s) slower than {args.tolerance}x the baseline')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,31 @@
+class Blitter:
+    '''
+    Used to redraw animated artists of an axes over a cached background. A full draw of the canvas captures the
+    background, and blit() only restores it and redraws the artists, whatever the size of the plotted data.
+    '''
+    def __init__(self, canvas, ax, artists=()):
+        self.canvas = canvas
+        self.ax = ax
+        self.artists = list(artists)
+        self.background = None
+        self.connection = canvas.mpl_connect('draw_event', self._on_draw)
+
+    def blit(self):
+        if self.background is None:
+            #Nothing cached yet, a full draw will capture the background and render the artists
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.ax.bbox)
+
+    def disconnect(self):
+        self.canvas.mpl_disconnect(self.connection)
+
+    def _on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
@@ -0,0 +1,115 @@
+import hashlib
+import os
+
+import numpy as np
+
+from instrumentation import stage
+
+#Default cache location and size cap, both can be overridden through the environment
+CACHE_DIR = os.environ.get('SPECTRAL_ANALYZER_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'spectral_analyzer'))
+MAX_CACHE_BYTES = int(os.environ.get('SPECTRAL_ANALYZER_CACHE_BYTES', 2 * 1024**3))
+
+def read_csv_arrays(path):
+    '''
+    Used to parse a two column csv spectrum into a (2, N) float64 array.
+    '''
+    import pandas as pd
+
+    with stage('csv_parse', path=path) as timing:
+        data = pd.read_csv(path, sep=',', skiprows=1, skip_blank_lines=True, header=None, usecols=[0, 1],
+                           dtype=np.float64)
+        timing['rows'] = len(data)
+    with stage('array_conversion', rows=len(data)):
+        return np.ascontiguousarray(data.to_numpy().T)
+
+class ImportCache:
+    '''
+    Used to keep memory mapped .npy copies of imported csv files, keyed by path, size and modification time.
+    '''
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path_key(self, path):
+        return hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+    def _entry(self, path):
+        stat = os.stat(path)
+        version = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f'{self._path_key(path)}-{version}.npy')
+
+    def _entries(self, prefix=''):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.startswith(prefix) and name.endswith('.npy')]
+
+    def load(self, path):
+        '''
+        Returns the (2, N) wavelength/power array for a csv file, parsing it only if no valid sidecar exists.
+        '''
+        entry = self._entry(path)
+        if os.path.exists(entry):
+            #Bump the modification time so eviction sees this entry as recently used
+            os.utime(entry)
+            with stage('sidecar_load', path=path):
+                return np.load(entry, mmap_mode='r')
+
+        values = read_csv_arrays(path)
+        try:
+            self._store(path, entry, values)
+        except OSError:
+            #A read only or full cache directory should never prevent an import
+            return values
+        return np.load(entry, mmap_mode='r')
+
+    def _store(self, path, entry, values):
+        os.makedirs(self.directory, exist_ok=True)
+
+        #Older versions of the same file can never be hit again
+        self.invalidate(path)
+
+        #Write to a temporary file first so a crash never leaves a truncated sidecar behind
+        temporary = f'{entry}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            np.save(file, values)
+        os.replace(temporary, entry)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache fits in max_bytes.
+        '''
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(entry)
+            total -= size
+
+    def invalidate(self, path=None):
+        '''
+        Removes the cached entries for a single csv file, or the whole cache if no path is given.
+        '''
+        prefix = '' if path is None else self._path_key(path)
+        for entry in self._entries(prefix):
+            self._remove(entry)
+
+    def size(self):
+        return sum(os.path.getsize(entry) for entry in self._entries())
+
+    def _remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+#Shared cache used by the application
+import_cache = ImportCache()
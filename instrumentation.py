@@ -0,0 +1,74 @@
+'''
+Optional timing of analysis stages. Disabled by default; when enabled, each stage is written as one JSON line to a log
+file and passed to any registered listeners, e.g. the main window status bar.
+'''
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_PATH = os.environ.get('SPECTRAL_ANALYZER_TIMING_LOG',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'spectral_analyzer', 'timings.jsonl'))
+
+enabled = os.environ.get('SPECTRAL_ANALYZER_TIMING', '') not in ('', '0')
+log_path = LOG_PATH
+listeners = []
+_lock = threading.Lock()
+
+def enable(path=None):
+    '''
+    Starts recording stage timings, to path if given.
+    '''
+    global enabled, log_path
+    if path is not None:
+        log_path = path
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def _record(entry):
+    with _lock:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            with open(log_path, 'a') as file:
+                file.write(json.dumps(entry, default=str) + '\n')
+        except OSError:
+            #Timing must never break an analysis
+            pass
+    for listener in list(listeners):
+        listener(entry)
+
+@contextmanager
+def stage(name, **fields):
+    '''
+    Times the enclosed block as stage name. The yielded dict can be filled with extra fields, such as iteration counts,
+    that are only known at the end. Costs a single flag check when timing is disabled.
+    '''
+    if not enabled:
+        yield {}
+        return
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        _record({'time': time.time(), 'stage': name, 'seconds': time.perf_counter() - start,
+                 'thread': threading.current_thread().name, **fields})
+
+def profile(fn, *args, output=None, **kwargs):
+    '''
+    Runs fn(*args, **kwargs) under cProfile and writes the statistics to output, by default a timestamped .prof file next
+    to the timing log. Returns the result of fn and the path of the statistics.
+    '''
+    if output is None:
+        output = os.path.join(os.path.dirname(os.path.abspath(log_path)), f'profile-{time.strftime("%Y%m%d-%H%M%S")}.prof')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(output)
+    return result, output
@@ -0,0 +1,296 @@
+'''
+Live acquisition from a watched directory or a local socket. Run as a script to stand in for the instrument:
+    python live.py send 5555 --count 1000 --interval 0.05
+'''
+import argparse
+import glob
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from import_cache import read_csv_arrays
+from instrumentation import stage
+from spectra import find_resonances, parabolic_offset
+from spectrum import Spectrum, ascending
+
+#Socket frames are a little endian uint64 sample count followed by that many float64 wavelengths and powers
+FRAME_HEADER = struct.Struct('<Q')
+
+class SpectrumRingBuffer:
+    '''
+    Used to keep the last capacity spectra, resampled onto the grid of the first one, in one preallocated array.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.grid = None
+        self.power = None
+        self.times = np.full(capacity, np.nan)
+        self.count = 0
+
+    def push(self, wavelength, power, timestamp=None):
+        '''
+        Stores a spectrum in ascending wavelength order and returns its row, valid until capacity more are pushed.
+        '''
+        wavelength, power = ascending(np.asarray(wavelength, dtype=np.float64), np.asarray(power, dtype=np.float64))
+        if self.grid is None:
+            self.grid = wavelength.copy()
+            self.power = np.empty((self.capacity, len(self.grid)))
+        row = self.power[self.count % self.capacity]
+        if len(wavelength) == len(self.grid) and np.array_equal(wavelength, self.grid):
+            row[:] = power
+        else:
+            row[:] = np.interp(self.grid, wavelength, power)
+        self.times[self.count % self.capacity] = time.time() if timestamp is None else timestamp
+        self.count += 1
+        return row
+
+    def latest(self):
+        return None if self.count == 0 else self.power[(self.count - 1) % self.capacity]
+
+    def ordered(self):
+        '''
+        Returns a copy of the stored spectra from oldest to newest.
+        '''
+        stored = min(self.count, self.capacity)
+        start = self.count - stored
+        return self.power[np.arange(start, self.count) % self.capacity]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+class ResonanceTracker:
+    '''
+    Used to follow the resonances of the first spectrum through later ones, each searched near its last position.
+    '''
+    def __init__(self, grid, capacity, prominence=3, kind='dip'):
+        self.grid = grid
+        self.capacity = capacity
+        self.prominence = prominence
+        self.sign = 1 if kind == 'dip' else -1
+        self.kind = kind
+        self.reference = None
+        self.count = 0
+
+    def _start(self, power):
+        result = find_resonances(Spectrum(self.grid, power), prominence=self.prominence, kind=self.kind)
+        if len(result.positions) == 0:
+            raise ValueError("No resonances found in the first live spectrum")
+        self.reference = result.positions.copy()
+
+        #Each resonance is searched within a quarter of the smallest spacing, so neighbours are never confused
+        step = (self.grid[-1] - self.grid[0]) / (len(self.grid) - 1)
+        spacing = np.min(result.FSR) if len(result.FSR) > 0 else (self.grid[-1] - self.grid[0]) / 2
+        self.half = max(int(spacing / step / 4), 2)
+        self.offsets = np.arange(-self.half, self.half + 1)
+        self.centers = np.searchsorted(self.grid, self.reference)
+        self.index = np.empty((len(self.reference), len(self.offsets)), dtype=np.intp)
+        self.values = np.empty((len(self.reference), len(self.offsets)))
+        self.positions = np.empty(len(self.reference))
+        self.minima = np.empty(len(self.reference))
+        self.FSR = np.empty(max(len(self.reference) - 1, 0))
+        self.history = np.full((self.capacity, len(self.reference)), np.nan)
+
+    def update(self, power):
+        '''
+        Tracks the resonances into the next spectrum, sampled on grid, and returns their positions (nm).
+        '''
+        with stage('live_track', points=len(power)):
+            if self.reference is None:
+                self._start(power)
+            last = len(self.grid) - 1
+            np.add(self.centers[:, None], self.offsets, out=self.index)
+            np.clip(self.index, 0, last, out=self.index)
+            np.take(power, self.index, out=self.values)
+            best = np.argmin(self.values, axis=1) if self.sign > 0 else np.argmax(self.values, axis=1)
+            self.centers = self.index[np.arange(len(best)), best]
+
+            #Parabolic refinement through each extremum and its neighbours
+            inner = np.clip(self.centers, 1, last - 1)
+            offset, minima = parabolic_offset(power[inner - 1], power[inner], power[inner + 1])
+            np.copyto(self.positions, np.interp(inner + offset, np.arange(len(self.grid)), self.grid))
+            np.copyto(self.minima, minima)
+            np.subtract(self.positions[1:], self.positions[:-1], out=self.FSR)
+            self.history[self.count % self.capacity] = self.positions
+            self.count += 1
+        return self.positions
+
+    @property
+    def shifts(self):
+        '''
+        Shift of every resonance from its position in the first spectrum, in nm.
+        '''
+        return self.positions - self.reference
+
+class DirectorySource:
+    '''
+    Used to read new csv spectra from a directory in order of modification time. Files must be renamed into place.
+    '''
+    def __init__(self, directory, pattern='*.csv', interval=0.02):
+        self.directory = directory
+        self.pattern = pattern
+        self.interval = interval
+        self.seen = set(glob.glob(os.path.join(directory, pattern)))
+
+    def run(self, emit, stop):
+        while not stop.is_set():
+            paths = set(glob.glob(os.path.join(self.directory, self.pattern))) - self.seen
+            for path in sorted(paths, key=os.path.getmtime):
+                self.seen.add(path)
+                values = read_csv_arrays(path)
+                emit(values[0], values[1])
+            if not paths:
+                stop.wait(self.interval)
+
+def _receive_into(connection, buffer, stop):
+    '''
+    Fills buffer from the connection, returning False if the peer closed it or stop was set.
+    '''
+    view = memoryview(buffer)
+    while len(view) and not stop.is_set():
+        try:
+            received = connection.recv_into(view)
+        except socket.timeout:
+            continue
+        if received == 0:
+            return False
+        view = view[received:]
+    return not stop.is_set()
+
+class SocketSource:
+    '''
+    Used to receive spectra as FRAME_HEADER frames on a local TCP port, from one sender at a time.
+    '''
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = socket.create_server((host, port))
+        self.server.settimeout(0.1)
+        self.port = self.server.getsockname()[1]
+
+    def run(self, emit, stop):
+        header = bytearray(FRAME_HEADER.size)
+        try:
+            while not stop.is_set():
+                try:
+                    connection, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    connection.settimeout(0.1)
+                    while _receive_into(connection, header, stop):
+                        points, = FRAME_HEADER.unpack(header)
+                        payload = bytearray(16 * points)
+                        if not _receive_into(connection, payload, stop):
+                            break
+                        values = np.frombuffer(payload, dtype='<f8').reshape(2, points)
+                        emit(values[0], values[1])
+        finally:
+            self.server.close()
+
+class LiveAcquisition:
+    '''
+    Used to read spectra from a source on a background thread until the owner drains them, e.g. from a GUI timer.
+    '''
+    def __init__(self, source, capacity=100, prominence=3, kind='dip'):
+        self.source = source
+        self.buffer = SpectrumRingBuffer(capacity)
+        self.prominence = prominence
+        self.kind = kind
+        self.tracker = None
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='live-acquisition', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        try:
+            self.source.run(lambda wavelength, power: self.queue.put((wavelength, power, time.time())),
+                            self.stop_event)
+        except Exception as error:
+            self.queue.put(error)
+
+    def drain(self):
+        '''
+        Processes the spectra received so far and returns how many there were, raising errors of the reading thread.
+        '''
+        received = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return received
+            if isinstance(item, Exception):
+                raise item
+            wavelength, power, timestamp = item
+            row = self.buffer.push(wavelength, power, timestamp)
+            if self.tracker is None:
+                self.tracker = ResonanceTracker(self.buffer.grid, self.buffer.capacity, self.prominence, self.kind)
+            self.tracker.update(row)
+            received += 1
+
+def drifting_spectra(count, points=20_000, drift=0.002, **kwargs):
+    '''
+    Yields synthetic ring spectra whose resonances move by drift nm per spectrum, as during heater tuning.
+    '''
+    from synthetic import ring_spectrum
+
+    for index in range(count):
+        yield ring_spectrum(points, shift=index * drift, seed=index, **kwargs)
+
+def write_spectra(directory, spectra, interval=0.05):
+    '''
+    Stands in for an instrument saving sweeps: writes each spectrum as a csv file, renamed into place once complete.
+    '''
+    from synthetic import write_csv
+
+    os.makedirs(directory, exist_ok=True)
+    for index, spectrum in enumerate(spectra):
+        path = os.path.join(directory, f'live_{index:06d}.csv')
+        write_csv(spectrum, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+        time.sleep(interval)
+
+def send_spectra(port, spectra, interval=0.05, host='127.0.0.1'):
+    '''
+    Stands in for an instrument streaming sweeps: sends each spectrum as one frame to a SocketSource.
+    '''
+    with socket.create_connection((host, port)) as connection:
+        for spectrum in spectra:
+            connection.sendall(FRAME_HEADER.pack(len(spectrum)))
+            connection.sendall(np.stack((spectrum.wavelength, spectrum.power)).astype('<f8').tobytes())
+            time.sleep(interval)
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--count', type=int, default=1000, help="number of spectra")
+    common.add_argument('--points', type=int, default=20_000, help="samples per spectrum")
+    common.add_argument('--drift', type=float, default=0.002, help="resonance drift per spectrum (nm)")
+    common.add_argument('--interval', type=float, default=0.05, help="seconds between spectra")
+
+    parser = argparse.ArgumentParser(description="Simulate an instrument for live acquisition.")
+    targets = parser.add_subparsers(dest='target', required=True)
+    write = targets.add_parser('write', parents=[common], help="write csv files into a watched directory")
+    write.add_argument('directory')
+    send = targets.add_parser('send', parents=[common], help="send frames to a listening socket source")
+    send.add_argument('port', type=int)
+    args = parser.parse_args(argv)
+
+    spectra = drifting_spectra(args.count, args.points, args.drift)
+    if args.target == 'write':
+        write_spectra(args.directory, spectra, args.interval)
+    else:
+        send_spectra(args.port, spectra, args.interval)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
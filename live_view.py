@@ -0,0 +1,45 @@
+import numpy as np
+
+from blitting import Blitter
+
+class LiveView:
+    '''
+    Shows the latest live spectrum and its tracked resonances on an MplCanvas with blitting. The axes, labels and legend
+    are rendered once into a cached background with fixed limits, and each update only restores that background and
+    redraws the spectrum line and the resonance markers.
+    '''
+    def __init__(self, canvas, grid, power, label='Live'):
+        self.canvas = canvas
+        self.ax = canvas.ax1
+
+        #Animated artists are skipped by a full draw and only rendered by update()
+        self.lod_line = canvas.plot_lod(grid, power, label=label, animated=True)
+        self.markers, = self.ax.plot([], [], 'x', color='red', label='Tracked resonances', animated=True)
+
+        #Limits stay fixed so the background never has to be redrawn while the resonances drift
+        low, high = np.nanmin(power), np.nanmax(power)
+        margin = 0.1 * (high - low) if high > low else 1
+        self.ax.set_xlim(grid[0], grid[-1])
+        self.ax.set_ylim(low - margin, high + margin)
+        self.ax.set_xlabel("Wavelength (nm)")
+        self.ax.set_ylabel("Transmission (dbm)")
+        self.ax.legend(loc='lower right')
+        self.blitter = Blitter(canvas, self.ax, (self.lod_line.line, self.markers))
+        canvas.draw()
+
+    def update(self, power, positions, minima):
+        '''
+        Shows a new spectrum, sampled on the grid of the first one, and the tracked resonance positions and minima.
+        '''
+        self.lod_line.set_ydata(power)
+        self.markers.set_data(positions, minima)
+        self.blitter.blit()
+
+    def stop(self):
+        '''
+        Leaves the last spectrum and markers on the canvas as ordinary artists.
+        '''
+        self.blitter.disconnect()
+        self.lod_line.line.set_animated(False)
+        self.markers.set_animated(False)
+        self.canvas.draw_idle()
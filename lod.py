@@ -0,0 +1,71 @@
+import numpy as np
+
+def minmax_decimate(x, y, bins):
+    '''
+    Reduces a line to at most about 2 * bins points by keeping the minimum and maximum of each bin of consecutive
+    samples, in their original order. Narrow resonance dips and peaks therefore survive decimation. The first and last
+    samples are always kept.
+    '''
+    n = len(x)
+    if n <= 2 * bins + 2:
+        return x, y
+
+    #Equal count bins over the bulk of the data, the remainder forms one short bin at the end
+    size = n // bins
+    full = size * bins
+    blocks = y[:full].reshape(bins, size)
+    offsets = np.arange(0, full, size)
+    indices = [offsets + np.argmin(blocks, axis=1), offsets + np.argmax(blocks, axis=1)]
+    if full < n:
+        tail = y[full:]
+        indices.append(np.array([full + np.argmin(tail), full + np.argmax(tail)]))
+    indices.append(np.array([0, n - 1]))
+
+    keep = np.unique(np.concatenate(indices))
+    return x[keep], y[keep]
+
+class LODLine:
+    '''
+    A Line2D that only holds a decimated copy of its data. The visible x range is decimated to about one min/max pair
+    per pixel column, and refresh() re-decimates after the view limits or the figure size change.
+    '''
+    def __init__(self, ax, x, y, **kwargs):
+        self.ax = ax
+        x = np.asarray(x)
+        y = np.asarray(y)
+
+        #Visible range lookups use searchsorted, which needs increasing wavelengths
+        if len(x) > 1 and np.any(np.diff(x) < 0):
+            order = np.argsort(x, kind='stable')
+            x = x[order]
+            y = y[order]
+        self.x = x
+        self.y = y
+        self.line, = ax.plot(*self._decimate(None), **kwargs)
+
+    def _decimate(self, limits):
+        x, y = self.x, self.y
+        if limits is not None and len(x) > 0:
+            low, high = sorted(limits)
+
+            #Keep one sample beyond each edge so the line runs to the axes border
+            first = max(np.searchsorted(x, low, side='left') - 1, 0)
+            last = min(np.searchsorted(x, high, side='right') + 1, len(x))
+            x = x[first:last]
+            y = y[first:last]
+        bins = max(int(self.ax.bbox.width), 1)
+        return minmax_decimate(x, y, bins)
+
+    def set_data(self, x, y):
+        '''
+        Replaces the full resolution data and redecimates it for the current view.
+        '''
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.line.set_data(*self._decimate(self.ax.get_xlim()))
+
+    def set_ydata(self, y):
+        self.set_data(self.x, y)
+
+    def refresh(self):
+        self.line.set_data(*self._decimate(self.ax.get_xlim()))
@@ -1,32 +1,67 @@
+import re
 import sys
 import numpy as np
-import pandas as pd
 
 from PyQt6.QtWidgets import (
     QMainWindow, QApplication,
     QLabel, QDialog, QToolBar, QStatusBar,
     QPushButton, QDialogButtonBox,
     QFormLayout, QDoubleSpinBox, QMessageBox,
-    QCheckBox, QFileDialog, QComboBox, QVBoxLayout, QHBoxLayout
+    QCheckBox, QFileDialog, QComboBox, QVBoxLayout, QHBoxLayout, QProgressBar, QSpinBox, QWidget, QLineEdit
 )
 from PyQt6.QtGui import QAction, QIcon
-from PyQt6.QtCore import Qt, QSize, QStringListModel
-
-from qt_material import apply_stylesheet
-
-from spectra import cos_func, compute_error, spectral_curve_fit, temperature_shift, calculate_FSR
-
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT as NavigationToolbar
+from PyQt6.QtCore import QSize, QThreadPool, QTimer
+
+from spectra import (fit_spectrum, temperature_shift, calculate_FSR, find_resonances, fit_resonances,
+                     get_model, resample)
+from spectrum import Spectrum, Workspace
+from import_cache import import_cache
+from result_cache import result_cache
+from lod import LODLine
+from partition_lines import PartitionLines
+from workers import Worker, TimingSignals
+import instrumentation
+from thermal_sweep import ThermalSweep
+from workspace_file import save_workspace, open_workspace
+from live import LiveAcquisition, DirectorySource, SocketSource
+from live_view import LiveView
+from stack import SpectrumStack
+from preprocess import Preprocessing, preprocess
+
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg, NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
+from matplotlib.ticker import MaxNLocator, ScalarFormatter
 
 #Set data storage
-data_list = []
-data_labels = []
+workspace = Workspace()
 
 #Set wavelength range
 wavelength_min = 1480
 wavelength_max = 1515
+
+#Above this many spectra, comparison plots show a waterfall image instead of overlaid lines
+waterfall_spectra = 8
+
+#Samples per spectrum of smoothed and waterfall previews in dialogs, a few times the pixel width of their canvas
+preview_points = 2048
+
+def preview_settings(settings, spacing, step):
+    '''
+    Scales the smoothing window of settings from samples spacing nm apart to preview samples step nm apart.
+    '''
+    return settings._replace(window=max(int(round(settings.window * spacing / step)), 1))
+
+def preview_spectrum(spectrum, settings):
+    '''
+    Returns spectrum smoothed with settings on at most preview_points samples, quick enough to redo on the GUI thread at
+    every change of the smoothing inputs.
+    '''
+    if len(spectrum) > preview_points:
+        grid = np.linspace(spectrum.wavelength[0], spectrum.wavelength[-1], preview_points)
+        spacing = (spectrum.wavelength[-1] - spectrum.wavelength[0]) / (len(spectrum) - 1)
+        settings = preview_settings(settings, spacing, grid[1] - grid[0])
+        spectrum = Spectrum(grid, resample(spectrum, grid), spectrum.label)
+    return preprocess(spectrum, settings)
 class MplCanvas(FigureCanvasQTAgg):
     '''
     This constitutes the main plotting canvas for spectral data.
@@ -37,6 +72,45 @@ class MplCanvas(FigureCanvasQTAgg):
         self.ax1 = fig.add_subplot(111)
         super(MplCanvas, self).__init__(fig)
 
+        #Level of detail lines are decimated to the visible range whenever the view changes
+        self.lod_lines = []
+        self.ax1.callbacks.connect('xlim_changed', self.refresh_lines)
+        self.mpl_connect('resize_event', self.refresh_lines)
+
+    def plot(self, x, y, **kwargs):
+        '''
+        Plots a spectrum as a level of detail line and returns its Line2D.
+        '''
+        return self.plot_lod(x, y, **kwargs).line
+
+    def plot_lod(self, x, y, **kwargs):
+        '''
+        Plots a spectrum as a level of detail line and returns the LODLine, whose data can be replaced in place.
+        '''
+        lod_line = LODLine(self.ax1, x, y, **kwargs)
+        self.lod_lines.append(lod_line)
+        return lod_line
+
+    def refresh_lines(self, *args):
+        '''
+        Re-decimates every line still on the axes for the current view.
+        '''
+        self.lod_lines = [lod_line for lod_line in self.lod_lines if lod_line.line.axes is not None]
+        for lod_line in self.lod_lines:
+            lod_line.refresh()
+
+    def draw(self):
+        with instrumentation.stage('canvas_draw', lines=len(self.lod_lines)):
+            super().draw()
+
+    def clear(self):
+        '''
+        Clears the axes, which also drops the axes callbacks, and reconnects the level of detail refresh.
+        '''
+        self.ax1.cla()
+        self.lod_lines = []
+        self.ax1.callbacks.connect('xlim_changed', self.refresh_lines)
+
 class MainWindow(QMainWindow):
     '''
     This is the main window of the application. It hosts the navigation, toolbar, and main plot windows.
@@ -48,6 +122,10 @@ class MainWindow(QMainWindow):
         self.canvas = MplCanvas(self, width=5, height=4, dpi=100)
         self.initialize_canvas = True
 
+        #Plotted spectra and their lines by label, and whether they are shown in microwatts rather than dBm
+        self.spectrum_lines = {}
+        self.linear = False
+
         self.setWindowTitle("Spectral Analysis")
         self.setFixedSize(QSize(800, 550))
 
@@ -66,10 +144,11 @@ class MainWindow(QMainWindow):
         add_data_button.triggered.connect(self.import_data)
         toolbar.addAction(add_data_button)
 
-        #Linearize data
+        #Toggle the displayed spectra between dBm and microwatts
         linearize_data_button = QAction(QIcon("icons/ui-tooltip--arrow.png"), "Linearize", self)
-        linearize_data_button.setStatusTip(("Linearize spectral response"))
-        linearize_data_button.triggered.connect(self.linearize_data)
+        linearize_data_button.setStatusTip(("Show spectral responses in microwatts instead of dBm"))
+        linearize_data_button.setCheckable(True)
+        linearize_data_button.toggled.connect(self.linearize_data)
         toolbar.addAction(linearize_data_button)
 
         #Clear the canvas and all data
@@ -78,11 +157,62 @@ class MainWindow(QMainWindow):
         clear_canvas_button.triggered.connect(self.clear_canvas)
         toolbar.addAction(clear_canvas_button)
 
+        #Cancel background tasks. Queued ones never start, running ones finish but their results are dropped
+        self.cancel_button = QAction("Cancel Pending", self)
+        self.cancel_button.setStatusTip("Cancel queued analyses and imports and discard the results of running ones")
+        self.cancel_button.triggered.connect(self.cancel_tasks)
+        self.cancel_button.setEnabled(False)
+        toolbar.addAction(self.cancel_button)
+
+        #Stop live acquisition
+        self.stop_live_button = QAction("Stop Live", self)
+        self.stop_live_button.setStatusTip("Stop live acquisition")
+        self.stop_live_button.triggered.connect(self.stop_live)
+        self.stop_live_button.setEnabled(False)
+        toolbar.addAction(self.stop_live_button)
+
         self.setStatusBar(QStatusBar(self))
 
+        #Background tasks, their progress is shown in the status bar
+        self.thread_pool = QThreadPool(self)
+        self.workers = []
+        self.tasks_started = 0
+
+        #One result window per analysis, reused for every run of that analysis
+        self.result_windows = {}
+
+        #Last partition points and settings of each analysis, stored with the workspace and used to fill in its dialog
+        self.analysis_windows = {}
+
+        #Open workspace file, which lazily loaded spectra are read from
+        self.workspace_file = None
+
+        #Live acquisition, drained by a timer on the GUI thread
+        self.live = None
+        self.live_view = None
+        self.live_timer = QTimer(self)
+        self.live_timer.setInterval(30)
+        self.live_timer.timeout.connect(self.update_live)
+
+        #Last thermal sweep, kept so newly loaded spectra can be appended to it
+        self.thermal_sweep = None
+        self.thermal_sweep_spectra = []
+        self.thermal_sweep_settings = None
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(150)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
+        #Stage timings are recorded on worker threads and shown in the status bar on the GUI thread
+        self.timing_signals = TimingSignals()
+        self.timing_signals.timing.connect(self.show_timing)
+        instrumentation.listeners.append(self.timing_signals.timing.emit)
+        self.profile_next = False
+        self.profile_path = None
+
         # Plotting toolbar
-        plotting_toolbar = NavigationToolbar(self.canvas, self)
-        toolbar.addWidget(plotting_toolbar)
+        self.plotting_toolbar = NavigationToolbar(self.canvas, self)
+        toolbar.addWidget(self.plotting_toolbar)
 
         #Menu
 
@@ -102,59 +232,154 @@ class MainWindow(QMainWindow):
         FSR = QAction("&FSR...", self)
         FSR.triggered.connect(self.calculate_FSR)
 
+        #Resonance detection
+        resonances = QAction("Find &Resonances...", self)
+        resonances.triggered.connect(self.find_resonances)
+
+        #All spectra as one image
+        waterfall = QAction("&Waterfall", self)
+        waterfall.setStatusTip("Show all spectra resampled onto a common grid as one image")
+        waterfall.triggered.connect(self.show_waterfall)
+
+        #Thermal sweep tracking
+        thermal_sweep = QAction("Thermal &Sweep...", self)
+        thermal_sweep.triggered.connect(self.track_thermal_sweep)
+        self.thermal_sweep_action = thermal_sweep
+
+        #Workspace files
+        open_workspace_action = QAction("&Open Workspace...", self)
+        open_workspace_action.setStatusTip("Open spectra, analysis windows and results saved in a workspace file")
+        open_workspace_action.triggered.connect(self.open_workspace)
+        save_workspace_action = QAction("&Save Workspace...", self)
+        save_workspace_action.setStatusTip("Save all spectra, analysis windows and cached results to a workspace file")
+        save_workspace_action.triggered.connect(self.save_workspace)
+
+        #Live acquisition from a watched directory or a local socket
+        live = QAction("&Live Acquisition...", self)
+        live.setStatusTip("Show spectra as they are acquired and track their resonances")
+        live.triggered.connect(self.start_live)
+
+        #Clear cached copies of imported files
+        clear_cache = QAction("Clear Import &Cache", self)
+        clear_cache.setStatusTip("Remove binary copies of previously imported files")
+        clear_cache.triggered.connect(self.clear_import_cache)
+
+        #Clear cached analysis results
+        clear_results = QAction("Clear &Result Cache", self)
+        clear_results.setStatusTip("Forget cached fit, FSR and temperature shift results")
+        clear_results.triggered.connect(self.clear_result_cache)
+
+        #Stage timing, written to the timing log and shown in the status bar
+        timing = QAction("&Timing Instrumentation", self)
+        timing.setStatusTip(f"Log the duration of every analysis stage to {instrumentation.log_path}")
+        timing.setCheckable(True)
+        timing.setChecked(instrumentation.enabled)
+        timing.toggled.connect(self.toggle_timing)
+
+        #cProfile capture of a single action
+        self.profile_action = QAction("&Profile Next Action", self)
+        self.profile_action.setStatusTip("Run the next import or analysis under cProfile")
+        self.profile_action.setCheckable(True)
+        self.profile_action.toggled.connect(self.toggle_profile)
+
         #Navigation menu
         menu = self.menuBar()
 
         file_menu = menu.addMenu("&File")
         file_menu.addSeparator()
         file_menu.addAction(file_import)
+        file_menu.addAction(open_workspace_action)
+        file_menu.addAction(save_workspace_action)
+        file_menu.addAction(live)
+        file_menu.addAction(clear_cache)
+        file_menu.addAction(clear_results)
 
         analyze_menu = menu.addMenu("&Analyze")
         analyze_menu.addSeparator()
         analyze_menu.addAction(curve_fit)
         analyze_menu.addAction(temperature)
         analyze_menu.addAction(FSR)
+        analyze_menu.addAction(resonances)
+        analyze_menu.addAction(thermal_sweep)
+        analyze_menu.addAction(waterfall)
+
+        tools_menu = menu.addMenu("&Tools")
+        tools_menu.addAction(timing)
+        tools_menu.addAction(self.profile_action)
 
     def import_data(self):
         '''
-        This method is used to import spectral response data. It accepts csv files only.
+        This method is used to import spectral response data. It accepts csv files only, several files are parsed at the
+        same time.
         '''
         menu = FileImportMenu()
-        if menu.exec():
+        if menu.exec() and menu.files:
             if self.initialize_canvas == True:
                 self.setCentralWidget(self.canvas)
 
             self.initialize_canvas = False
 
-            #Read in spectral data - wavelength and transmission arrays
-            data = pd.read_csv(str(menu.file_label.text()), sep=',' , skiprows=0, skip_blank_lines=True, header=None)
-            dataX = np.array(data.iloc[1:][0])  # Definition of the array for the wavelenghts in nanometers
-            dataY = np.array(data.iloc[1:][1])
-
-            #Append data to stored collection of signal data
-            data_list.append(data)
-            self.data_index += 1
-            data_labels.append(f'Spectral Response {self.data_index}')
-
-            #Draw plot
-            if menu.overlay.isChecked() == False:
-                self.canvas.ax1.cla()
-            self.canvas.ax1.plot(dataX, dataY, label=f'Spectral Response {self.data_index}')
-            self.canvas.ax1.set_xlabel("Wavelength (nm)")
-            self.canvas.ax1.set_ylabel("Transmission (dbm)")
-            self.canvas.ax1.legend(loc='lower right')
-            self.canvas.draw()
+            #Read in spectral data - wavelength and transmission arrays, one background task per file
+            labels = []
+            for _ in menu.files:
+                self.data_index += 1
+                while f'Spectral Response {self.data_index}' in workspace:
+                    self.data_index += 1
+                labels.append(f'Spectral Response {self.data_index}')
+            batch = ImportBatch(self, labels, menu.overlay.isChecked())
+            for index, (path, label) in enumerate(zip(menu.files, labels)):
+                self.run_in_background(f'Importing {label}', Spectrum.from_csv, path, label=label,
+                                       on_result=lambda spectrum, index=index: batch.result(index, spectrum),
+                                       on_finished=lambda index=index: batch.finished(index))
+
+    def add_spectrum(self, spectrum, overlay, draw=True):
+        '''
+        This method stores an imported spectrum and plots it. With draw=False the canvas is left for the caller to redraw.
+        '''
+        #Append data to stored collection of signal data
+        workspace.add(spectrum)
+
+        #Draw plot
+        if overlay == False:
+            self.clear_plot()
+        self.plot_spectrum(spectrum)
+        if draw:
+            self.finish_plot()
+
+    def plot_spectrum(self, spectrum):
+        '''
+        This method plots a spectrum on the main canvas in the current display unit.
+        '''
+        power = spectrum.linear if self.linear else spectrum.power
+        lod_line = self.canvas.plot_lod(spectrum.wavelength, power, label=spectrum.label)
+        self.spectrum_lines[spectrum.label] = (spectrum, lod_line)
+
+    def clear_plot(self):
+        self.stop_live()
+        self.canvas.clear()
+        self.spectrum_lines = {}
+
+    def finish_plot(self):
+        '''
+        This method labels the main plot and redraws the canvas.
+        '''
+        self.canvas.ax1.set_xlabel("Wavelength (nm)")
+        self.canvas.ax1.set_ylabel("Transmission (uW)" if self.linear else "Transmission (dbm)")
+        self.canvas.ax1.legend(loc='lower right')
+        self.canvas.draw()
 
     def fit_spectral_data(self):
         '''
         This method accepts a spectral response and will fit a cosine curve to the selected data.
         '''
-        if len(data_list) == 0:
+        if len(workspace) == 0:
             error_window = ErrorMenu("No data available!")
             error_window.exec()
             return
         menu = CurveFitMenu()
+        self.restore_window("curve_fit", menu)
         if menu.exec():
+            self.store_window("curve_fit", menu)
 
             #Validate proper parameters for wavelength selection
             if menu.end_param.value () <= menu.start_param.value():
@@ -163,28 +388,132 @@ class MainWindow(QMainWindow):
                 return
 
             #Select signal from stored data signal collection
-            selected_data = menu.curve_input.currentText()
-            selected_index = data_labels.index(selected_data)
-            data = data_list[selected_index]
+            data = workspace[menu.curve_input.currentText()]
 
             #Fit curve
-            dataX, dataY_norm, fitted_curve = spectral_curve_fit(data, menu.start_param.value(), menu.end_param.value())
-            plt.plot(dataX, dataY_norm, label='data')
-            plt.plot(dataX, fitted_curve, '-', label='fit')
-            plt.xlabel("Wavelength (nm)")
-            plt.ylabel("Normalized transmission")
-            plt.show()
+            self.run_in_background(f'Fitting {data.label}', fit_spectrum, data, menu.start_param.value(),
+                                   menu.end_param.value(), on_result=self.plot_curve_fit)
+
+    def result_window(self, name, xlabel, ylabel):
+        '''
+        This method returns the result window of an analysis, creating it on first use.
+        '''
+        if name not in self.result_windows:
+            self.result_windows[name] = ResultWindow(name, xlabel, ylabel, self)
+        return self.result_windows[name]
+
+    def plot_curve_fit(self, result):
+        '''
+        This method plots a fitted cosine curve over the normalized data.
+        '''
+        window = self.result_window("Curve Fit", "Wavelength (nm)", "Normalized transmission")
+        window.line('data', result.wavelength, result.normalized, label='data')
+        window.line('fit', result.wavelength, result.fitted_curve, label='fit')
+        window.finish(f'D = {result.parameters[0]:.3f}, E = {result.parameters[1]:.3f} rad/nm')
+
+    def plot_temperature_shift(self, result):
+        '''
+        This method plots the windows of both spectra and the distance between their minima.
+        '''
+        window = self.result_window("Temperature Shift", "Wavelength (nm)", "Transmission (dbm)")
+        window.line('signal1', result.wavelength1, result.power1, label='Signal 1')
+        window.line('signal2', result.wavelength2, result.power2, label='Signal 2')
+        window.marker('shift', [result.minimum1, result.minimum2], [result.power_min, result.power_min], color='black',
+                      linestyle='dashed', label='Distance Shift')
+        if np.isnan(result.shift):
+            window.finish('Shift distance: correlation peak outside the window')
+        else:
+            window.finish(f'Shift distance: {round(abs(result.shift), 3)} nm')
+
+    def plot_FSR(self, result):
+        '''
+        This method plots a spectrum with both peak windows and the distance between the peaks.
+        '''
+        window = self.result_window("FSR", "Wavelength (nm)", "Transmission (uW)")
+        window.line('spectrum', result.wavelength, result.power_linear, label='Long MZI', color='blue')
+        window.marker('FSR', [result.peak1, result.peak2], [result.peak2_power, result.peak2_power], color='blue',
+                      linestyle='dashed', label='FSR')
+        for index, position in enumerate(result.windows):
+            window.marker(f'window{index}', [position, position], [0, 1], linestyle='dashed', color='black',
+                          transform=window.canvas.ax1.get_xaxis_transform())
+        window.finish(f'FSR: {round(result.FSR, 3)} nm')
+
+    def plot_resonances(self, data, result):
+        '''
+        This method plots a spectrum with its detected resonances marked.
+        '''
+        window = self.result_window("Resonances", "Wavelength (nm)", "Transmission (dbm)")
+        window.line('spectrum', data.wavelength, data.power, label=data.label)
+        window.marker('resonances', result.positions, result.power, 'x', color='red', label='Resonances')
+        title = f'{len(result.positions)} resonances'
+        if len(result.FSR) > 0:
+            title = f'{title}, mean FSR: {round(np.mean(result.FSR), 3)} nm'
+        window.finish(title)
+
+    def plot_resonance_fit(self, data, result):
+        '''
+        This method plots a spectrum with the model fitted to each of its resonances, in dBm.
+        '''
+        window = self.result_window("Resonances", "Wavelength (nm)", "Transmission (dbm)")
+        window.line('spectrum', data.wavelength, data.power, label=data.label)
+        model = get_model(result.model)
+        fitted = result.converged
+
+        #Each fit is drawn over three linewidths on either side, separated by NaN so all fits form a single line
+        offsets = np.append(np.linspace(-3, 3, 61), np.nan)
+        x = result.positions[fitted, None] + offsets * result.linewidths[fitted, None]
+        with np.errstate(all='ignore'):
+            y = 10 * np.log10(model.function(x, *result.parameters[fitted].T[:, :, None]) / 1000)
+        window.marker('fit', x.ravel(), y.ravel(), color='red', label=f'{model.name} fit')
+        window.marker('resonances', result.positions[fitted],
+                      np.interp(result.positions[fitted], data.wavelength, data.power), 'x', color='red',
+                      label='Resonances')
+        title = f'{np.count_nonzero(fitted)} of {len(fitted)} resonances fitted'
+        if fitted.any():
+            title = (f'{title}, median Q: {np.median(result.Q[fitted]):.0f}, '
+                     f'median linewidth: {np.median(result.linewidths[fitted]) * 1000:.1f} pm')
+        window.finish(title)
+
+    def plot_waterfall(self, stack):
+        '''
+        This method shows a stack of spectra as a waterfall image, one row per spectrum.
+        '''
+        window = self.result_window("Waterfall", "Wavelength (nm)", "Spectrum")
+        window.image('waterfall', stack.power, (stack.grid[0], stack.grid[-1], len(stack) - 0.5, -0.5),
+                     label="Transmission (dbm)")
+
+        #Few spectra are labelled by name, many by index
+        ax = window.canvas.ax1
+        if len(stack) <= waterfall_spectra:
+            ax.set_yticks(range(len(stack)), stack.labels)
+        else:
+            ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+            ax.yaxis.set_major_formatter(ScalarFormatter())
+        window.finish(f'{len(stack)} spectra on {len(stack.grid)} points')
+
+    def plot_thermal_sweep(self, sweep):
+        '''
+        This method plots the shift of each tracked resonance against temperature.
+        '''
+        window = self.result_window("Thermal Sweep", "Temperature (°C)", "Resonance shift (nm)")
+        temperatures = np.array(sweep.temperatures)
+        for index, (position, shift, slope) in enumerate(zip(sweep.reference, sweep.shifts.T, sweep.slopes)):
+            window.marker(f'resonance{index}', temperatures, shift, 'o-',
+                          label=f'{round(position, 2)} nm: {round(slope * 1000, 2)} pm/°C')
+        window.finish(f'{len(sweep.reference)} resonances')
 
     def calculate_temperature_shift(self):
         '''
         This method calculates the temperature shift of two spectral resonance peaks in nanometers.
         '''
-        if len(data_list) < 2:
+        if len(workspace) < 2:
             error_window = ErrorMenu("Must have at least two spectral response signals!")
             error_window.exec()
             return
         menu = TemperatureShiftMenu()
+        self.restore_window("temperature_shift", menu)
         if menu.exec():
+            self.store_window("temperature_shift", menu)
 
             #Parameter validation
             if menu.signal1_input.currentText() == menu.signal2_input.currentText():
@@ -197,26 +526,28 @@ class MainWindow(QMainWindow):
                 return
 
             #Select spectral responses for comparison
-            selected_data1 = menu.signal1_input.currentText()
-            selected_index1 = data_labels.index(selected_data1)
-            data1 = data_list[selected_index1]
-            selected_data2 = menu.signal2_input.currentText()
-            selected_index2 = data_labels.index(selected_data2)
-            data2 = data_list[selected_index2]
+            data1 = workspace[menu.signal1_input.currentText()]
+            data2 = workspace[menu.signal2_input.currentText()]
 
             #Calculates and plots temperature shift distance
-            temperature_shift(data1, data2, menu.start1_param.value(), menu.end1_param.value())
+            method = 'xcorr' if menu.method_input.currentText() == "Cross-correlation" else 'minimum'
+            self.run_in_background(f'Temperature shift of {data1.label} and {data2.label}', temperature_shift, data1,
+                                   data2, menu.start1_param.value(), menu.end1_param.value(),
+                                   method=method, preprocessing=menu.preprocessing.settings(),
+                                   on_result=self.plot_temperature_shift)
 
     def calculate_FSR(self):
         '''
         This method calculates the free spectral range of a spectral response.
         '''
-        if len(data_list) == 0:
+        if len(workspace) == 0:
             error_window = ErrorMenu("No data available!")
             error_window.exec()
             return
         menu = FSRMenu()
+        self.restore_window("FSR", menu)
         if menu.exec():
+            self.store_window("FSR", menu)
 
             #Parameter validation
             if ((menu.peak1_start.value() >= menu.peak1_end.value()) | (menu.peak2_start.value() >= menu.peak2_end.value()) | (menu.peak1_end.value() >= menu.peak2_end.value())):
@@ -225,45 +556,571 @@ class MainWindow(QMainWindow):
                 return
 
             #Select spectral signal to compute FSR
-            selected_data = menu.signal_input.currentText()
-            selected_index = data_labels.index(selected_data)
-            data = data_list[selected_index]
+            data = workspace[menu.signal_input.currentText()]
 
             #Calculate FSR between two resonance peaks
-            calculate_FSR(data, menu.peak1_start.value(), menu.peak1_end.value(), menu.peak2_start.value(), menu.peak2_end.value())
+            self.run_in_background(f'FSR of {data.label}', calculate_FSR, data, menu.peak1_start.value(),
+                                   menu.peak1_end.value(), menu.peak2_start.value(), menu.peak2_end.value(),
+                                   preprocessing=menu.preprocessing.settings('peak'), on_result=self.plot_FSR)
+
+    def find_resonances(self):
+        '''
+        This method detects every resonance of a spectral response and the FSR between adjacent resonances.
+        '''
+        if len(workspace) == 0:
+            error_window = ErrorMenu("No data available!")
+            error_window.exec()
+            return
+        menu = ResonanceMenu()
+        if menu.exec():
+            data = workspace[menu.signal_input.currentText()]
+            kind = 'dip' if menu.kind_input.currentText() == "Dips" else 'peak'
+            model = menu.model_input.currentText()
+            if model == "None":
+                self.run_in_background(f'Finding resonances in {data.label}', find_resonances, data,
+                                       prominence=menu.prominence.value(), kind=kind,
+                                       preprocessing=menu.preprocessing.settings(kind),
+                                       on_result=lambda result: self.plot_resonances(data, result))
+            else:
+                self.run_in_background(f'Fitting resonances in {data.label}', fit_resonances, data, model.lower(),
+                                       prominence=menu.prominence.value(), kind=kind,
+                                       preprocessing=menu.preprocessing.settings(kind),
+                                       on_result=lambda result: self.plot_resonance_fit(data, result))
+
+    def show_waterfall(self):
+        '''
+        This method resamples all loaded spectra onto a common grid and shows them as one image.
+        '''
+        if len(workspace) < 2:
+            error_window = ErrorMenu("Must have at least two spectral response signals!")
+            error_window.exec()
+            return
+
+        #Spectra of an opened workspace file are read by the worker as it resamples them, not here
+        labels = workspace.labels()
+        self.run_in_background('Resampling spectra', SpectrumStack.from_spectra, (workspace[label] for label in labels),
+                               dtype=np.float32, on_result=self.plot_waterfall)
+
+    def track_thermal_sweep(self):
+        '''
+        This method tracks every resonance across all loaded spectra, in load order, and fits their shift against
+        temperature. Running it again with the same settings only adds the spectra loaded since the last run.
+        '''
+        if len(workspace) < 2:
+            error_window = ErrorMenu("Must have at least two spectral response signals!")
+            error_window.exec()
+            return
+        menu = ThermalSweepMenu()
+        self.restore_window("thermal_sweep", menu)
+        stored = self.analysis_windows.get("thermal_sweep_temperatures", [])
+        if len(stored) == len(workspace) or (stored and not menu.temperatures_input.text()):
+            menu.set_temperatures(stored)
+        if menu.exec():
+            self.store_window("thermal_sweep", menu)
+            if menu.end_param.value() <= menu.start_param.value():
+                error_window = ErrorMenu("Parameters out of bounds!")
+                error_window.exec()
+                return
+            try:
+                temperatures = menu.temperatures()
+            except ValueError:
+                error_window = ErrorMenu("Temperatures must be numbers separated by commas or spaces!")
+                error_window.exec()
+                return
+            if len(temperatures) != len(workspace):
+                error_window = ErrorMenu(f"Enter one temperature for each of the {len(workspace)} spectra!")
+                error_window.exec()
+                return
+            self.analysis_windows["thermal_sweep_temperatures"] = temperatures
+
+            #Reuse the previous sweep when only new spectra, with their temperatures, were added
+            settings = (menu.start_param.value(), menu.end_param.value())
+            spectra = list(workspace)
+            if (self.thermal_sweep is None or self.thermal_sweep_settings != settings
+                    or spectra[:len(self.thermal_sweep)] != self.thermal_sweep_spectra
+                    or temperatures[:len(self.thermal_sweep)] != self.thermal_sweep.temperatures):
+                self.thermal_sweep = ThermalSweep(start=settings[0], end=settings[1])
+                self.thermal_sweep_spectra = []
+                self.thermal_sweep_settings = settings
+            new_spectra = spectra[len(self.thermal_sweep):]
+            self.thermal_sweep_spectra.extend(new_spectra)
+            temperatures = temperatures[len(self.thermal_sweep):]
+
+            #The sweep keeps running sums, so only one run may extend it at a time
+            sweep = self.thermal_sweep
+            self.thermal_sweep_action.setEnabled(False)
+            self.run_in_background('Tracking thermal sweep', sweep.extend, new_spectra, temperatures,
+                                   on_result=lambda result: self.plot_thermal_sweep(sweep),
+                                   on_finished=lambda: self.thermal_sweep_action.setEnabled(True))
+
+    def start_live(self):
+        '''
+        This method starts live acquisition. Spectra are read on a background thread and shown as they arrive.
+        '''
+        menu = LiveMenu()
+        if not menu.exec():
+            return
+        try:
+            if menu.source_input.currentText() == "Directory":
+                if not menu.directory:
+                    raise ValueError("No directory selected")
+                source = DirectorySource(menu.directory)
+                description = menu.directory
+            else:
+                source = SocketSource(menu.port.value())
+                description = f'port {source.port}'
+        except (OSError, ValueError) as error:
+            error_window = ErrorMenu(f"Could not start live acquisition: {error}")
+            error_window.exec()
+            return
+
+        self.clear_plot()
+        if self.initialize_canvas == True:
+            self.setCentralWidget(self.canvas)
+        self.initialize_canvas = False
+        self.live = LiveAcquisition(source, menu.capacity.value(), menu.prominence.value()).start()
+        self.live_timer.start()
+        self.stop_live_button.setEnabled(True)
+        self.statusBar().showMessage(f"Live: waiting for spectra from {description}...")
+
+    def update_live(self):
+        '''
+        This method takes in the spectra received since the last call, tracks their resonances and shows the latest one.
+        '''
+        try:
+            received = self.live.drain()
+        except Exception as error:
+            self.stop_live()
+            error_window = ErrorMenu(f"Live acquisition failed: {error}")
+            error_window.exec()
+            return
+        if received == 0:
+            return
+
+        buffer = self.live.buffer
+        tracker = self.live.tracker
+        if self.live_view is None:
+            self.live_view = LiveView(self.canvas, buffer.grid, buffer.latest())
+        self.live_view.update(buffer.latest(), tracker.positions, tracker.minima)
+
+        message = f"Live: {buffer.count} spectra, {len(tracker.positions)} resonances"
+        if len(tracker.FSR) > 0:
+            message = f"{message}, mean FSR {np.mean(tracker.FSR):.4f} nm"
+        self.statusBar().showMessage(f"{message}, mean shift {np.mean(tracker.shifts) * 1000:.1f} pm")
+
+    def stop_live(self):
+        '''
+        This method stops live acquisition and leaves the last spectrum on the canvas.
+        '''
+        if self.live is None:
+            return
+        self.live_timer.stop()
+        self.live.stop()
+        if self.live_view is not None:
+            self.live_view.stop()
+        self.statusBar().showMessage(f"Live acquisition stopped after {self.live.buffer.count} spectra", 5000)
+        self.live = None
+        self.live_view = None
+        self.stop_live_button.setEnabled(False)
+
+    def restore_window(self, name, menu):
+        '''
+        This method fills in the parameters of an analysis dialog with the values last used for that analysis.
+        '''
+        for param, value in zip(menu.params, self.analysis_windows.get(name, [])):
+            param.setValue(value)
+
+    def store_window(self, name, menu):
+        self.analysis_windows[name] = [param.value() for param in menu.params]
+
+    def save_workspace(self):
+        '''
+        This method saves all loaded spectra, the analysis windows and the cached analysis results to a workspace file.
+        '''
+        if len(workspace) == 0:
+            error_window = ErrorMenu("No data available!")
+            error_window.exec()
+            return
+        #Uncompressed workspaces are larger, but open without reading their spectra
+        path, selected = QFileDialog.getSaveFileName(self, "Save Workspace", "",
+                                                     "Spectral workspace (*.npz);;Compressed spectral workspace (*.npz)")
+        if not path:
+            return
+        if not path.endswith('.npz'):
+            path = f'{path}.npz'
+        self.run_in_background(f'Saving workspace to {path}', save_workspace, path, workspace,
+                               dict(self.analysis_windows), compress=selected.startswith("Compressed"),
+                               on_result=lambda counts: self.statusBar().showMessage(
+                                   f"Saved {counts[0]} spectra and {counts[1]} results to {path}", 5000))
+
+    def open_workspace(self):
+        '''
+        This method replaces the loaded spectra with those of a workspace file. Spectra of an uncompressed file are
+        memory mapped and plotted straight away, those of a compressed file are read in the background first.
+        '''
+        path, _ = QFileDialog.getOpenFileName(self, "Open Workspace", "", "Spectral workspace (*.npz)")
+        if not path:
+            return
+        try:
+            file = open_workspace(path, workspace)
+        except (OSError, ValueError, KeyError) as error:
+            error_window = ErrorMenu(f"Could not open {path}: {error}")
+            error_window.exec()
+            return
+        if self.workspace_file is not None:
+            self.workspace_file.close()
+        self.workspace_file = file
+
+        self.analysis_windows = dict(file.windows)
+        self.thermal_sweep = None
+        self.data_index = len(workspace)
+        if self.initialize_canvas == True:
+            self.setCentralWidget(self.canvas)
+        self.initialize_canvas = False
+        self.clear_plot()
+        self.canvas.draw()
+        if file.compressed:
+            self.run_in_background(f'Reading {path}', list, workspace, on_result=self.plot_workspace)
+        else:
+            self.plot_workspace(workspace)
+
+    def plot_workspace(self, spectra):
+        '''
+        This method plots spectra on the main canvas with a single redraw.
+        '''
+        self.clear_plot()
+        for spectrum in spectra:
+            self.plot_spectrum(spectrum)
+        self.finish_plot()
+
+    def run_in_background(self, description, fn, *args, on_result=None, on_finished=None, **kwargs):
+        '''
+        This method runs fn on the thread pool and hands its result to on_result on the GUI thread. on_finished is called
+        once the task has ended, whether it succeeded, failed or was cancelled.
+        '''
+        if self.profile_next:
+            #Only the next action is profiled, the statistics path is reported once it finishes
+            self.profile_action.setChecked(False)
+            profiled_fn = fn
+            fn = lambda *args, **kwargs: instrumentation.profile(profiled_fn, *args, **kwargs)
+            if on_result is not None:
+                profiled_on_result = on_result
+                on_result = lambda result: (self.show_profile(result[1]), profiled_on_result(result[0]))
+            else:
+                on_result = lambda result: self.show_profile(result[1])
+        worker = Worker(description, fn, *args, **kwargs)
+        if on_result is not None:
+            worker.signals.result.connect(on_result)
+        worker.signals.error.connect(self.show_task_error)
+        if on_finished is not None:
+            worker.signals.finished.connect(on_finished)
+        worker.signals.finished.connect(lambda: self.finish_task(worker))
+
+        self.workers.append(worker)
+        self.tasks_started += 1
+        self.thread_pool.start(worker)
+        self.update_progress()
+        return worker
+
+    def update_progress(self):
+        '''
+        This method shows how many of the running tasks have finished in the status bar.
+        '''
+        if len(self.workers) == 0:
+            self.tasks_started = 0
+            self.progress_bar.hide()
+            self.cancel_button.setEnabled(False)
+            return
+
+        #A single task shows a busy indicator until it finishes
+        if self.tasks_started == 1:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, self.tasks_started)
+            self.progress_bar.setValue(self.tasks_started - len(self.workers))
+        self.progress_bar.show()
+        self.cancel_button.setEnabled(True)
+
+        descriptions = [worker.description for worker in self.workers]
+        message = descriptions[0] if len(descriptions) == 1 else f'{len(descriptions)} tasks running'
+        self.statusBar().showMessage(f'{message}...')
+
+    def finish_task(self, worker):
+        '''
+        This method removes a finished task from the status bar.
+        '''
+        if worker in self.workers:
+            self.workers.remove(worker)
+        if len(self.workers) == 0:
+            message, timeout = "Cancelled" if worker.cancelled else "Done", 3000
+            if self.profile_path is not None:
+                message, timeout = f"{message}, profile written to {self.profile_path}", 10000
+                self.profile_path = None
+            self.statusBar().showMessage(message, timeout)
+        self.update_progress()
+
+    def cancel_tasks(self):
+        '''
+        This method cancels all tasks. Tasks still waiting for a thread are never started, running ones are left to
+        finish and their results discarded. Workers are not auto deleted, so tryTake is safe on finished ones.
+        '''
+        for worker in list(self.workers):
+            worker.cancel()
+            if self.thread_pool.tryTake(worker):
+                #Never started, so report it as finished to everything waiting on it
+                worker.signals.finished.emit()
+
+    def toggle_timing(self, checked):
+        '''
+        This method switches stage timing on or off.
+        '''
+        if checked:
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def toggle_profile(self, checked):
+        self.profile_next = checked
+
+    def show_timing(self, entry):
+        '''
+        This method shows the duration of a finished stage in the status bar.
+        '''
+        self.statusBar().showMessage(f"{entry['stage']}: {entry['seconds'] * 1000:.1f} ms", 5000)
+
+    def show_profile(self, path):
+        #Reported by finish_task, which would otherwise overwrite the message
+        self.profile_path = path
+
+    def show_task_error(self, message, details):
+        '''
+        Shows the error of a background task, with its traceback behind the details button.
+        '''
+        error_window = QMessageBox(QMessageBox.Icon.Critical, "ERROR!", message, QMessageBox.StandardButton.Ok, self)
+        error_window.setDetailedText(details)
+        error_window.exec()
+
     def clear_canvas(self):
         '''
         This method clears the plotting canvas.
         '''
 
         #Clears existing spectral data
-        data_list.clear()
-        data_labels.clear()
+        workspace.clear()
+        if self.workspace_file is not None:
+            self.workspace_file.close()
+            self.workspace_file = None
 
         #Reset canvas
         self.data_index = 0
-        self.canvas.ax1.cla()
+        self.clear_plot()
         self.canvas.draw()
 
-    def linearize_data(self):
+    def clear_import_cache(self):
+        '''
+        This method removes all cached binary copies of imported csv files.
+        '''
+        import_cache.invalidate()
+        self.statusBar().showMessage("Import cache cleared", 3000)
+
+    def clear_result_cache(self):
+        '''
+        This method empties the analysis result cache and reports how well it was used.
+        '''
+        stats = result_cache.stats()
+        result_cache.clear()
+        self.statusBar().showMessage(f"Result cache cleared ({stats['hits']} hits, {stats['misses']} misses)", 3000)
+
+    def linearize_data(self, checked):
+        '''
+        This method switches the plotted spectra between dBm and microwatts. The existing lines keep their artists and
+        only swap in the cached data of the other unit, so the canvas is redrawn once however many spectra are shown.
+        '''
+        self.linear = checked
+        with instrumentation.stage('unit_toggle', lines=len(self.spectrum_lines), linear=checked):
+            for spectrum, lod_line in self.spectrum_lines.values():
+                lod_line.set_ydata(spectrum.linear if checked else spectrum.power)
+
+            #Keep the wavelength range and rescale the power axis to the new unit. The zoom history is in the old unit
+            ax = self.canvas.ax1
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+            self.plotting_toolbar.update()
+            self.plotting_toolbar.push_current()
+            self.finish_plot()
+
+class ImportBatch:
+    '''
+    Collects the spectra of one multi-file import. Files are parsed in parallel and finish in any order, but each
+    spectrum is added to the workspace as soon as every file selected before it has finished, so the workspace keeps the
+    selection order. The canvas is drawn once, after the last file.
+    '''
+    def __init__(self, window, labels, overlay):
+        self.window = window
+        self.overlay = overlay
+        self.spectra = [None] * len(labels)
+        self.done = [False] * len(labels)
+        self.added = 0
+        self.next = 0
+
+    def result(self, index, spectrum):
+        self.spectra[index] = spectrum
+
+    def finished(self, index):
+        '''
+        Marks a file as finished, successfully or not, and adds every spectrum that is now next in order.
+        '''
+        self.done[index] = True
+        while self.next < len(self.done) and self.done[self.next]:
+            spectrum = self.spectra[self.next]
+            if spectrum is not None:
+                #Without overlay the new files replace the plotted data, but not each other
+                self.window.add_spectrum(spectrum, self.overlay or self.added > 0, draw=False)
+                self.added += 1
+            self.spectra[self.next] = None
+            self.next += 1
+        if self.next == len(self.done) and self.added > 0:
+            self.window.finish_plot()
+
+class ResultWindow(QDialog):
+    '''
+    This window shows the latest result of one analysis. Its artists are created by the first result and updated in
+    place by later ones, so repeated analyses reuse a single figure.
+    '''
+    def __init__(self, title, xlabel, ylabel, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle(title)
+        self.canvas = MplCanvas(self, width=5, height=4, dpi=100)
+        self.canvas.ax1.set_xlabel(xlabel)
+        self.canvas.ax1.set_ylabel(ylabel)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.toolbar)
+        self.layout.addWidget(self.canvas)
+        self.setLayout(self.layout)
+
+        #Artists by name, and the names set since the last finish()
+        self.lines = {}
+        self.markers = {}
+        self.images = {}
+        self.colorbars = {}
+        self.updated = set()
+
+    def line(self, name, x, y, **kwargs):
+        '''
+        Shows spectrum data as the level of detail line name.
+        '''
+        if name in self.lines:
+            self.lines[name].set_data(x, y)
+        else:
+            self.lines[name] = self.canvas.plot_lod(x, y, **kwargs)
+        self.updated.add(name)
+
+    def marker(self, name, x, y, *args, **kwargs):
+        '''
+        Shows a few points, such as resonance markers or a distance bar, as the plain line name.
+        '''
+        if name in self.markers:
+            self.markers[name].set_data(x, y)
+            self.markers[name].set_label(kwargs.get('label', self.markers[name].get_label()))
+        else:
+            self.markers[name], = self.canvas.ax1.plot(x, y, *args, **kwargs)
+        self.updated.add(name)
+
+    def image(self, name, data, extent, label=None, **kwargs):
+        '''
+        Shows a two dimensional array, such as a waterfall of spectra, as the image name with a colorbar.
+        '''
+        if name in self.images:
+            self.images[name].set_data(data)
+            self.images[name].set_extent(extent)
+            self.images[name].autoscale()
+        else:
+            self.images[name] = self.canvas.ax1.imshow(data, extent=extent, aspect='auto', **kwargs)
+            self.colorbars[name] = self.canvas.figure.colorbar(self.images[name], ax=self.canvas.ax1, label=label)
+        self.updated.add(name)
+
+    def finish(self, title):
+        '''
+        Removes the artists the latest result did not set, rescales to the new data and shows the window.
+        '''
+        for artists in (self.lines, self.markers, self.images):
+            for name in [name for name in artists if name not in self.updated]:
+                artist = artists.pop(name)
+                if name in self.colorbars:
+                    self.colorbars.pop(name).remove()
+                (artist.line if isinstance(artist, LODLine) else artist).remove()
+        self.updated = set()
+
+        #Rescale x to the full resolution data, which also re-decimates the lines, then y to the decimated lines
+        ax = self.canvas.ax1
+        xs = [lod_line.x for lod_line in self.lines.values()]
+        xs += [np.asarray(marker.get_xdata(), dtype=float) for marker in self.markers.values()
+               if marker.get_transform() == ax.transData]
+        xs = [x[np.isfinite(x)] for x in xs]
+        xs = [x for x in xs if len(x) > 0]
+        if xs:
+            low = min(np.min(x) for x in xs)
+            high = max(np.max(x) for x in xs)
+            margin = 0.05 * (high - low) if high > low else 0.5
+            ax.set_xlim(low - margin, high + margin)
+        elif self.images:
+            #Images fill the axes without a margin
+            extents = np.array([image.get_extent()[:2] for image in self.images.values()])
+            ax.set_xlim(extents.min(), extents.max())
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+
+        ax.set_title(title)
+        if ax.get_legend_handles_labels()[0]:
+            ax.legend(loc='lower right')
+        elif ax.get_legend() is not None:
+            ax.get_legend().remove()
+        self.toolbar.update()
+        self.canvas.draw_idle()
+        self.show()
+        self.raise_()
+
+class PreprocessingInputs(QWidget):
+    '''
+    Smoothing and baseline removal inputs shared by the analysis dialogs.
+    '''
+    filters = {"None": 'none', "Savitzky-Golay": 'savgol', "Median": 'median', "FIR low-pass": 'fir'}
+    baselines = {"None": None, "Linear": 1, "Quadratic": 2, "Cubic": 3}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.filter_input = QComboBox()
+        self.filter_input.addItems(list(self.filters))
+        self.window = QSpinBox(minimum=1, maximum=1001, value=11, singleStep=2)
+        self.baseline_input = QComboBox()
+        self.baseline_input.addItems(list(self.baselines))
+
+        layout = QFormLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addRow("Smoothing", self.filter_input)
+        layout.addRow("Smoothing window (samples)", self.window)
+        layout.addRow("Baseline removal", self.baseline_input)
+        self.setLayout(layout)
+
+    def connect(self, slot):
         '''
-        This method converts spectral data from dBm into microwatts.
+        Calls slot whenever the settings change.
         '''
-        n=0
-        self.canvas.ax1.cla()
+        self.filter_input.currentIndexChanged.connect(slot)
+        self.window.valueChanged.connect(slot)
+        self.baseline_input.currentIndexChanged.connect(slot)
 
-        #Linearizes all stored spectral signals and replots them
-        if len(data_list) > 0:
-            for data in data_list:
-                n+=1
-                dataX = np.array(data.iloc[1:][0])
-                dataY = np.array(data.iloc[1:][1])
-                dataY_linear = 10**(dataY/10)*1000
-                self.canvas.ax1.plot(dataX, dataY_linear, label=f'Spectral Response {n}')
-                self.canvas.ax1.set_xlabel("Wavelength (nm)")
-                self.canvas.ax1.set_ylabel("Transmission (uW)")
-                self.canvas.ax1.legend(loc='lower right')
-                self.canvas.draw()
+    def settings(self, kind='dip'):
+        '''
+        Returns the selected Preprocessing, or None if nothing is selected. kind says whether the analysis looks for dips
+        or peaks, which the baseline has to stay clear of.
+        '''
+        settings = Preprocessing(self.filters[self.filter_input.currentText()], self.window.value(),
+                                 baseline=self.baselines[self.baseline_input.currentText()], kind=kind)
+        return settings if settings.active else None
 
 class FileImportMenu(QDialog):
     '''
@@ -280,10 +1137,11 @@ class FileImportMenu(QDialog):
         self.buttonBox.accepted.connect(self.accept)
         self.buttonBox.rejected.connect(self.reject)
 
-        self.file_input = QPushButton(text="Select File...")
+        self.file_input = QPushButton(text="Select Files...")
         self.file_input.clicked.connect(self.get_files)
 
         self.file_label = QLabel("")
+        self.files = []
 
         #If this is checked, new spectral data will be plotted on top of previous data.
         self.overlay = QCheckBox("Overlay new data")
@@ -297,14 +1155,18 @@ class FileImportMenu(QDialog):
 
     def get_files(self):
         '''
-        This method gets file data and updates labels.
+        This method gets file data and updates labels. Several files can be selected at once.
         '''
         dlg = QFileDialog()
-        filenames = QStringListModel()
+        dlg.setFileMode(QFileDialog.FileMode.ExistingFiles)
+        dlg.setNameFilter("CSV files (*.csv);;All files (*)")
 
         if dlg.exec():
-            filenames = dlg.selectedFiles()
-            self.file_label.setText(filenames[0])
+            self.files = dlg.selectedFiles()
+            if len(self.files) == 1:
+                self.file_label.setText(self.files[0])
+            else:
+                self.file_label.setText(f'{len(self.files)} files selected')
 
 class CurveFitMenu(QDialog):
     '''
@@ -323,7 +1185,7 @@ class CurveFitMenu(QDialog):
 
         #Initialize spectral response input
         self.curve_input = QComboBox()
-        self.curve_input.addItems(data_labels)
+        self.curve_input.addItems(workspace.labels())
 
         #Initialize parameter guess value range
         self.start_param = QDoubleSpinBox(minimum=0, maximum=20)
@@ -334,6 +1196,7 @@ class CurveFitMenu(QDialog):
         self.layout.addRow("Spectral response", self.curve_input)
         self.layout.addRow("Starting parameter value", self.start_param)
         self.layout.addRow("Starting ending value", self.end_param)
+        self.params = [self.start_param, self.end_param]
         self.layout.addWidget(self.buttonBox)
         self.setLayout(self.layout)
 
@@ -359,10 +1222,14 @@ class TemperatureShiftMenu(QDialog):
 
         #Initiliaze two spectral response inputs
         self.signal1_input = QComboBox()
-        self.signal1_input.addItems(data_labels)
+        self.signal1_input.addItems(workspace.labels())
         self.signal1_input.activated.connect(self.update_plot)
         self.signal2_input = QComboBox()
-        self.signal2_input.addItems(data_labels)
+        self.signal2_input.addItems(workspace.labels())
+
+        #Shift from the window minima or from cross-correlation of the whole window
+        self.method_input = QComboBox()
+        self.method_input.addItems(["Minimum", "Cross-correlation"])
 
         #Initialize partition point selection
         self.start1_param = QDoubleSpinBox(minimum=wavelength_min, maximum=wavelength_max)
@@ -370,53 +1237,98 @@ class TemperatureShiftMenu(QDialog):
         self.end1_param = QDoubleSpinBox(minimum=wavelength_min, maximum=wavelength_max)
         self.end1_param.valueChanged.connect(self.update_plot)
 
+        #Many spectra are easier to compare as one image, resampled onto a common grid
+        self.stack = None
+        self.waterfall = QCheckBox("Waterfall view")
+        self.waterfall.setChecked(len(workspace) > waterfall_spectra)
+        self.waterfall.toggled.connect(self.plot_spectra)
+
+        #Filtered spectra are cached, so the spectra are only filtered again when the settings change
+        self.preprocessing = PreprocessingInputs()
+        self.preprocessed_stacks = {}
+
         self.layout = QFormLayout()
         self.layout.addRow("Spectral response 1", self.signal1_input)
         self.layout.addRow("Spectral response 2", self.signal2_input)
+        self.layout.addRow("Shift method", self.method_input)
         self.layout.addRow("Partition Starting Point", self.start1_param)
         self.layout.addRow("Partition Ending Point", self.end1_param)
+        self.layout.addRow(self.preprocessing)
+        self.layout.addWidget(self.waterfall)
         self.layout.addWidget(self.canvas_temp)
         self.layout.addWidget(self.buttonBox)
         self.setLayout(self.layout)
 
-        #Select data for comparison
-        selected_data1 = self.signal1_input.currentText()
-        selected_index1 = data_labels.index(selected_data1)
-
-        #Spectral Response 1
-        data1 = data_list[selected_index1]
-        selected_data2 = self.signal2_input.currentText()
-        selected_index2 = data_labels.index(selected_data2)
+        #Draw partition lines, dragging a line updates the matching spinbox
+        self.params = [self.start1_param, self.end1_param]
+        self.partition_lines = PartitionLines(self.canvas_temp, [param.value() for param in self.params],
+                                              ['black', 'black'], on_drag=self.drag_line)
 
-        # Spectral Response 2
-        data2 = data_list[selected_index2]
-        n=0
         #Plot temperature shift of spectral signals
-        for data in data_list:
-            n += 1
-            dataX = np.array(data.iloc[1:][0])
-            dataY = np.array(data.iloc[1:][1])
-            self.canvas_temp.ax1.plot(dataX, dataY, label=f'Spectral Response {n}')
-            self.canvas_temp.ax1.set_xlabel("Wavelength (nm)")
-            self.canvas_temp.ax1.set_ylabel("Transmission (dbm)")
-            self.canvas_temp.ax1.legend(loc='lower right')
-
-        #Draw partition lines
-        self.line_start = self.canvas_temp.ax1.axvline(self.start1_param.value(), color='black', lw=1, linestyle='--')
-        self.line_end = self.canvas_temp.ax1.axvline(self.end1_param.value(), color='black', lw=1, linestyle='--')
-        self.canvas_temp.draw()
+        self.plot_spectra()
+        self.preprocessing.connect(self.plot_spectra)
 
+    def plot_spectra(self):
+        '''
+        Shows all spectra, either as overlaid lines or as a waterfall image with one row per spectrum, after the selected
+        smoothing and baseline removal.
+        '''
+        settings = self.preprocessing.settings()
+        self.canvas_temp.clear()
+        ax = self.canvas_temp.ax1
+        ax.set_xlabel("Wavelength (nm)")
+        if self.waterfall.isChecked():
+            stack = self.preview_stack(settings)
+            if stack is None:
+                ax.text(0.5, 0.5, "The spectra do not overlap", transform=ax.transAxes, ha='center')
+            else:
+                ax.imshow(stack.power, extent=(stack.grid[0], stack.grid[-1], len(stack) - 0.5, -0.5),
+                          aspect='auto')
+                ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+            ax.set_ylabel("Spectrum")
+        else:
+            for spectrum in workspace:
+                if settings is not None:
+                    spectrum = preview_spectrum(spectrum, settings)
+                self.canvas_temp.plot(spectrum.wavelength, spectrum.power, label=spectrum.label)
+            ax.set_ylabel("Transmission (dbm)")
+            ax.legend(loc='lower right')
+
+        #Clearing the axes removed the partition lines
+        self.partition_lines.attach()
+        self.canvas_temp.draw()
 
+    def preview_stack(self, settings):
+        '''
+        Returns the waterfall preview, resampled to preview_points so it is quick to build on the GUI thread whatever
+        the size of the workspace, or None if the spectra do not overlap.
+        '''
+        if self.stack is None:
+            try:
+                self.stack = SpectrumStack.from_spectra(workspace, points=preview_points, dtype=np.float32)
+            except ValueError:
+                return None
+        if settings is None:
+            return self.stack
+        if settings not in self.preprocessed_stacks:
+            #Smoothing windows are given in samples of the measured spectra, which are finer than the preview
+            spacing = min((spectrum.wavelength[-1] - spectrum.wavelength[0]) / max(len(spectrum) - 1, 1)
+                          for spectrum in workspace)
+            self.preprocessed_stacks[settings] = self.stack.preprocessed(preview_settings(settings, spacing,
+                                                                                          self.stack.step))
+        return self.preprocessed_stacks[settings]
 
     def update_plot(self):
         '''
         Adjust partition lines for selecting temperature peaks
         '''
-        self.line_start.remove()
-        self.line_end.remove()
-        self.line_start = self.canvas_temp.ax1.axvline(self.start1_param.value(), color='black', lw=1, linestyle='--')
-        self.line_end = self.canvas_temp.ax1.axvline(self.end1_param.value(), color='black', lw=1, linestyle='--')
-        self.canvas_temp.draw()
+        self.partition_lines.set_positions([param.value() for param in self.params])
+
+    def drag_line(self, index, position):
+        '''
+        Moves the spinbox belonging to a dragged partition line, which in turn moves the line.
+        '''
+        self.params[index].setValue(position)
 
 
 class FSRMenu(QDialog):
@@ -438,7 +1350,7 @@ class FSRMenu(QDialog):
 
         #Initialize signal input
         self.signal_input = QComboBox()
-        self.signal_input.addItems(data_labels)
+        self.signal_input.addItems(workspace.labels())
         self.signal_input.activated.connect(self.select_signal)
 
         #Initialize peak partition points
@@ -451,66 +1363,203 @@ class FSRMenu(QDialog):
         self.peak2_end = QDoubleSpinBox(minimum=wavelength_min, maximum=wavelength_max)
         self.peak2_end.valueChanged.connect(self.update_plot)
 
+        #The FSR is measured between maxima, which the baseline has to stay clear of
+        self.preprocessing = PreprocessingInputs()
+
         self.layout = QFormLayout()
         self.layout.addRow("Spectral response", self.signal_input)
         self.layout.addRow("Peak 1: Partition Starting Point: ", self.peak1_start)
         self.layout.addRow("Peak 1: Partition Ending Point: ", self.peak1_end)
         self.layout.addRow("Peak 2: Partition Starting Point: ", self.peak2_start)
         self.layout.addRow("Peak 2: Partition Ending Point: ", self.peak2_end)
+        self.layout.addRow(self.preprocessing)
         self.layout.addWidget(self.canvas_FSR)
         self.layout.addWidget(self.buttonBox)
         self.setLayout(self.layout)
 
         #Linearize data
-        data_FSR = data_list[0]
-        dataX = np.array(data_FSR.iloc[1:][0])
-        dataY = np.array(data_FSR.iloc[1:][1])
-        dataY_linear = 10 ** (dataY / 10) * 1000
-
-        #Initialize partition lines for spectral peaks
-        self.canvas_FSR.ax1.plot(dataX, dataY_linear, label=f'Spectral Response')
-        self.line_peak1_start = self.canvas_FSR.ax1.axvline(self.peak1_start.value(), color='black', lw=1, linestyle='--')
-        self.line_peak1_end = self.canvas_FSR.ax1.axvline(self.peak1_end.value(), color='black', lw=1, linestyle='--')
-        self.line_peak2_start = self.canvas_FSR.ax1.axvline(self.peak2_start.value(), color='red', lw=1,linestyle='--')
-        self.line_peak2_end = self.canvas_FSR.ax1.axvline(self.peak2_end.value(), color='red', lw=1, linestyle='--')
+        data_FSR = workspace[self.signal_input.currentText()]
+
+        #Initialize partition lines for spectral peaks, dragging a line updates the matching spinbox
+        self.canvas_FSR.plot(data_FSR.wavelength, data_FSR.linear, label=f'Spectral Response')
+        self.params = [self.peak1_start, self.peak1_end, self.peak2_start, self.peak2_end]
+        self.partition_lines = PartitionLines(self.canvas_FSR, [param.value() for param in self.params],
+                                              ['black', 'black', 'red', 'red'], on_drag=self.drag_line)
 
         self.canvas_FSR.ax1.set_xlabel("Wavelength (nm)")
         self.canvas_FSR.ax1.set_ylabel("Transmission (uW)")
         self.canvas_FSR.ax1.legend(loc='lower right')
         self.canvas_FSR.draw()
+        self.preprocessing.connect(self.select_signal)
 
     def select_signal(self):
         '''
         Select signal from stored data signal collection
         '''
         selected_data = self.signal_input.currentText()
-        selected_index = data_labels.index(selected_data)
-        data_FSR = data_list[selected_index]
-        dataX = np.array(data_FSR.iloc[1:][0])
-        dataY = np.array(data_FSR.iloc[1:][1])
-        dataY_linear = 10 ** (dataY / 10) * 1000
+        data_FSR = workspace[selected_data]
+        settings = self.preprocessing.settings('peak')
+        if settings is not None:
+            data_FSR = preview_spectrum(data_FSR, settings)
 
         #Update plot with selected response
-        self.canvas_FSR.ax1.cla()
-        self.canvas_FSR.ax1.plot(dataX, dataY_linear, label=f'{selected_data}')
+        self.canvas_FSR.clear()
+        self.canvas_FSR.plot(data_FSR.wavelength, data_FSR.linear, label=f'{selected_data}')
         self.canvas_FSR.ax1.set_xlabel("Wavelength (nm)")
         self.canvas_FSR.ax1.set_ylabel("Transmission (uW)")
         self.canvas_FSR.ax1.legend(loc='lower right')
+
+        #Clearing the axes removed the partition lines
+        self.partition_lines.attach()
         self.canvas_FSR.draw()
 
     def update_plot(self):
         #Update partition lines
-        self.line_peak1_start.remove()
-        self.line_peak1_end.remove()
-        self.line_peak2_start.remove()
-        self.line_peak2_end.remove()
-        self.line_peak1_start = self.canvas_FSR.ax1.axvline(self.peak1_start.value(), color='black', lw=1,linestyle='--')
-        self.line_peak1_end = self.canvas_FSR.ax1.axvline(self.peak1_end.value(), color='black', lw=1, linestyle='--')
-        self.line_peak2_start = self.canvas_FSR.ax1.axvline(self.peak2_start.value(), color='red', lw=1,linestyle='--')
-        self.line_peak2_end = self.canvas_FSR.ax1.axvline(self.peak2_end.value(), color='red', lw=1, linestyle='--')
-        self.canvas_FSR.draw()
+        self.partition_lines.set_positions([param.value() for param in self.params])
+
+    def drag_line(self, index, position):
+        '''
+        Moves the spinbox belonging to a dragged partition line, which in turn moves the line.
+        '''
+        self.params[index].setValue(position)
 
 
+class ResonanceMenu(QDialog):
+    '''
+    This menu is used to detect all resonances of a spectral response.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Find Resonances")
+
+        QBtn = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+
+        self.buttonBox = QDialogButtonBox(QBtn)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+        #Initialize signal input
+        self.signal_input = QComboBox()
+        self.signal_input.addItems(workspace.labels())
+
+        #Resonances show up as transmission dips or peaks depending on the device
+        self.kind_input = QComboBox()
+        self.kind_input.addItems(["Dips", "Peaks"])
+
+        #Minimum extinction ratio for a resonance
+        self.prominence = QDoubleSpinBox(minimum=0.1, maximum=60, value=3)
+
+        #Optional line shape fitted to every resonance for linewidth and Q
+        self.model_input = QComboBox()
+        self.model_input.addItems(["None", "Lorentzian", "Airy"])
+
+        #Smoothing applies to the detection, fits always use the measured spectrum
+        self.preprocessing = PreprocessingInputs()
+
+        self.layout = QFormLayout()
+        self.layout.addRow("Spectral response", self.signal_input)
+        self.layout.addRow("Resonance type", self.kind_input)
+        self.layout.addRow("Minimum extinction ratio (dB)", self.prominence)
+        self.layout.addRow("Fit model", self.model_input)
+        self.layout.addRow(self.preprocessing)
+        self.layout.addWidget(self.buttonBox)
+        self.setLayout(self.layout)
+
+class LiveMenu(QDialog):
+    '''
+    This menu is used to start live acquisition from a watched directory or a local socket.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Live Acquisition")
+
+        QBtn = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+
+        self.buttonBox = QDialogButtonBox(QBtn)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+        #Spectra are either saved as csv files into a directory or streamed to a local port
+        self.source_input = QComboBox()
+        self.source_input.addItems(["Directory", "Socket"])
+
+        self.directory = ""
+        self.directory_input = QPushButton(text="Select Directory...")
+        self.directory_input.clicked.connect(self.get_directory)
+        self.directory_label = QLabel("")
+
+        self.port = QSpinBox(minimum=1024, maximum=65535, value=5555)
+
+        #Number of most recent spectra kept
+        self.capacity = QSpinBox(minimum=2, maximum=100000, value=100)
+
+        #Minimum extinction ratio for a tracked resonance
+        self.prominence = QDoubleSpinBox(minimum=0.1, maximum=60, value=3)
+
+        self.layout = QFormLayout()
+        self.layout.addRow("Source", self.source_input)
+        self.layout.addRow(self.directory_input, self.directory_label)
+        self.layout.addRow("Port", self.port)
+        self.layout.addRow("Spectra kept", self.capacity)
+        self.layout.addRow("Minimum extinction ratio (dB)", self.prominence)
+        self.layout.addWidget(self.buttonBox)
+        self.setLayout(self.layout)
+
+    def get_directory(self):
+        '''
+        This method selects the watched directory.
+        '''
+        directory = QFileDialog.getExistingDirectory(self, "Watched Directory")
+        if directory:
+            self.directory = directory
+            self.directory_label.setText(directory)
+
+class ThermalSweepMenu(QDialog):
+    '''
+    This menu is used to track resonances across all loaded spectra of a thermal sweep.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle("Thermal Sweep")
+
+        QBtn = QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+
+        self.buttonBox = QDialogButtonBox(QBtn)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+        #Band in which resonances are tracked
+        self.start_param = QDoubleSpinBox(minimum=wavelength_min, maximum=wavelength_max, value=wavelength_min)
+        self.end_param = QDoubleSpinBox(minimum=wavelength_min, maximum=wavelength_max, value=wavelength_max)
+
+        #One measured temperature per loaded spectrum, in load order, filled in from the labels when they all name one
+        labels = workspace.labels()
+        self.temperatures_input = QLineEdit()
+        self.temperatures_input.setPlaceholderText("25, 26.5, 28, ...")
+        matches = [re.search(r'(-?\d+(?:\.\d+)?)\s*(?:°|deg)?C(?![a-zA-Z])', label) for label in labels]
+        if all(matches):
+            self.temperatures_input.setText(', '.join(match.group(1) for match in matches))
+
+        self.layout = QFormLayout()
+        self.layout.addRow("Band starting point", self.start_param)
+        self.layout.addRow("Band ending point", self.end_param)
+        self.layout.addRow(f"Temperatures of the {len(labels)} spectra (°C)", self.temperatures_input)
+        self.params = [self.start_param, self.end_param]
+        self.layout.addWidget(self.buttonBox)
+        self.setLayout(self.layout)
+
+    def set_temperatures(self, temperatures):
+        self.temperatures_input.setText(', '.join(f'{temperature:g}' for temperature in temperatures))
+
+    def temperatures(self):
+        '''
+        Returns the entered temperatures. Raises ValueError unless they are numbers separated by commas or spaces.
+        '''
+        return [float(value) for value in self.temperatures_input.text().replace(',', ' ').split()]
+
 class ErrorMenu(QDialog):
     '''
     This is an all-purpose error menu, mostly used for validation issues.
@@ -531,7 +1580,8 @@ class ErrorMenu(QDialog):
         self.layout.addWidget(self.buttonBox)
         self.setLayout(self.layout)
 
-app = QApplication(sys.argv)
-window = MainWindow()
-window.show()
-app.exec()
\ No newline at end of file
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    window = MainWindow()
+    window.show()
+    app.exec()
\ No newline at end of file
@@ -0,0 +1,73 @@
+from blitting import Blitter
+
+class PartitionLines:
+    '''
+    Vertical partition lines drawn over a canvas with blitting. The plotted data is rendered once into a cached
+    background, and moving a line only restores that background and redraws the line artists, so updates cost the same
+    regardless of the size of the spectrum. Lines can also be dragged with the mouse.
+    '''
+    #Distance in pixels within which a click picks up a line
+    pick_tolerance = 5
+
+    def __init__(self, canvas, positions, colors, on_drag=None):
+        self.canvas = canvas
+        self.ax = canvas.ax1
+        self.colors = colors
+        self.on_drag = on_drag
+        self.dragging = None
+        self.lines = []
+        self.blitter = Blitter(canvas, self.ax)
+        self.attach(positions)
+
+        canvas.mpl_connect('button_press_event', self._on_press)
+        canvas.mpl_connect('motion_notify_event', self._on_motion)
+        canvas.mpl_connect('button_release_event', self._on_release)
+
+    def attach(self, positions=None):
+        '''
+        Creates the line artists, e.g. again after the axes have been cleared.
+        '''
+        if positions is None:
+            positions = self.positions()
+        for line in self.lines:
+            if line in self.ax.lines:
+                line.remove()
+
+        #Animated artists are skipped by a full draw and only rendered by blit()
+        self.lines = [self.ax.axvline(position, color=color, lw=1, linestyle='--', animated=True)
+                      for position, color in zip(positions, self.colors)]
+        self.blitter.artists = self.lines
+        self.blitter.background = None
+
+    def positions(self):
+        return [line.get_xdata()[0] for line in self.lines]
+
+    def set_positions(self, positions):
+        '''
+        Moves all lines and updates the canvas.
+        '''
+        for line, position in zip(self.lines, positions):
+            line.set_xdata([position, position])
+        self.blitter.blit()
+
+    def _on_press(self, event):
+        if event.inaxes is not self.ax or event.button != 1:
+            return
+
+        #Pick the closest line in screen space
+        distances = [abs(self.ax.transData.transform((position, 0))[0] - event.x) for position in self.positions()]
+        if distances and min(distances) <= self.pick_tolerance:
+            self.dragging = distances.index(min(distances))
+
+    def _on_motion(self, event):
+        if self.dragging is None or event.inaxes is not self.ax or event.xdata is None:
+            return
+        if self.on_drag is not None:
+            self.on_drag(self.dragging, event.xdata)
+        else:
+            positions = self.positions()
+            positions[self.dragging] = event.xdata
+            self.set_positions(positions)
+
+    def _on_release(self, event):
+        self.dragging = None
@@ -0,0 +1,184 @@
+'''
+Smoothing and baseline removal applied to spectra before peak search and fitting, so noise spikes in low power sweeps
+are not mistaken for resonance minima or maxima. Filters run along the last axis of a (spectra, points) array of dBm
+power, so one spectrum and a whole sweep go through the same vectorized code. Filtered spectra are cached by content
+and settings like any other analysis result.
+'''
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from instrumentation import stage
+from result_cache import memoize
+from spectrum import Spectrum, as_spectrum
+
+FILTERS = ('none', 'savgol', 'median', 'fir')
+
+#Working memory for one block of spectra or one piece of a long spectrum
+CHUNK_BYTES = 64 * 1024**2
+
+#The baseline is fitted to the medians of this many segments of each spectrum
+BASELINE_SEGMENTS = 256
+
+#Refinements of the baseline towards the transmission away from the resonances
+BASELINE_ITERATIONS = 20
+
+class Preprocessing(NamedTuple):
+    '''
+    Preprocessing settings. filter is one of FILTERS and window its length in samples, rounded up to an odd number.
+    order is the Savitzky-Golay polynomial order and cutoff the FIR low-pass cutoff as a fraction of the Nyquist
+    frequency. baseline is the order of a polynomial baseline removed from every spectrum, or None to keep the baseline.
+    The baseline follows the envelope away from the resonances, which are dips or peaks depending on kind.
+    '''
+    filter: str = 'none'
+    window: int = 11
+    order: int = 3
+    cutoff: float = 0.1
+    baseline: Optional[int] = None
+    kind: str = 'dip'
+
+    @property
+    def active(self):
+        return self.filter != 'none' or self.baseline is not None
+
+def _filter_window(settings, points):
+    '''
+    Filter length for spectra of points samples: odd so it is centered, and never longer than the spectra.
+    '''
+    return min(settings.window | 1, points if points % 2 else points - 1)
+
+def _overlap(settings, window):
+    '''
+    Samples on either side that a filtered sample depends on. The forward and backward passes of the FIR filter each
+    reach a full filter length, Savitzky-Golay and median filters half of one.
+    '''
+    if settings.filter == 'fir':
+        return window - 1
+    if settings.filter == 'none':
+        return 0
+    return window // 2
+
+def _filter_block(rows, settings, window):
+    import scipy.signal
+
+    points = rows.shape[-1]
+    if settings.filter == 'savgol':
+        if window <= settings.order:
+            return rows
+        return scipy.signal.savgol_filter(rows, window, settings.order, axis=-1)
+    if settings.filter == 'median':
+        #scipy.signal.medfilt pads with zeros, which would put false minima at the ends of every spectrum. Row by row is
+        #an order of magnitude faster, median_filter only has a fast path for one dimensional input
+        import scipy.ndimage
+        return np.stack([scipy.ndimage.median_filter(row, size=window, mode='nearest') for row in rows])
+    if settings.filter == 'fir':
+        if window < 3:
+            return rows
+        #Filtering forwards and backwards cancels the phase delay, which would otherwise shift every resonance
+        taps = scipy.signal.firwin(window, settings.cutoff)
+        return scipy.signal.filtfilt(taps, [1.0], rows, axis=-1, padlen=min(3 * window, points - 1))
+    return rows
+
+def _filter_long(row, out, settings, span):
+    '''
+    Filters a single spectrum in pieces of about span samples. Each piece is extended by the overlap the filter needs on
+    either side and the overlap is trimmed afterwards, so the result equals filtering the whole spectrum at once. out
+    may be row itself: the left overlap of each piece is copied before the previous piece is written over it.
+    '''
+    window = _filter_window(settings, len(row))
+    pad = _overlap(settings, window)
+
+    #Equal pieces, none shorter than the filter
+    span = max(span, 2 * (window + pad))
+    edges = np.linspace(0, len(row), -(-len(row) // span) + 1).astype(np.intp)
+    carried = row[:0].copy()
+    for first, last in zip(edges[:-1], edges[1:]):
+        piece = np.concatenate((carried, row[first:min(last + pad, len(row))]))
+        filtered = _filter_block(piece[None, :], settings, window)[0]
+        start = len(carried)
+        carried = row[max(last - pad, 0):last].copy()
+        out[first:last] = filtered[start:start + last - first]
+
+def _baseline_coefficients(rows, order, kind, span):
+    '''
+    Fits a polynomial baseline to every row with one shared pseudo-inverse and returns its coefficients on [-1, 1]. The
+    fit runs on the medians of short segments, which are insensitive to noise, and each iteration clips the segments
+    inside resonances to the last fit, so the baseline settles on the transmission between the resonances instead of
+    being pulled into them. The medians are taken about span samples at a time.
+    '''
+    points = rows.shape[-1]
+    segments = min(points, BASELINE_SEGMENTS)
+    length = points // segments
+    group = max(1, span // length)
+    levels = np.empty((len(rows), segments))
+    for first in range(0, segments, group):
+        last = min(first + group, segments)
+        levels[:, first:last] = np.median(rows[:, first * length:last * length].reshape(len(rows), -1, length), axis=-1)
+
+    #Segment centers on the same [-1, 1] axis the baseline is evaluated on
+    centers = -1 + (np.arange(segments) * length + (length - 1) / 2) * (2 / max(points - 1, 1))
+    vandermonde = np.polynomial.polynomial.polyvander(centers, order)
+    projection = np.linalg.pinv(vandermonde).T
+    clip = np.maximum if kind == 'dip' else np.minimum
+    for _ in range(BASELINE_ITERATIONS):
+        coefficients = levels @ projection
+        clip(levels, coefficients @ vandermonde.T, out=levels)
+    return coefficients
+
+def _remove_baseline(rows, out, coefficients, span):
+    '''
+    Writes rows minus the baseline given by coefficients into out, about span samples at a time.
+    '''
+    points = rows.shape[-1]
+    order = coefficients.shape[1] - 1
+    for first in range(0, points, span):
+        last = min(first + span, points)
+        x = -1 + np.arange(first, last) * (2 / max(points - 1, 1))
+        out[:, first:last] = rows[:, first:last] - coefficients @ np.polynomial.polynomial.polyvander(x, order).T
+
+def preprocess_rows(rows, settings, out=None, chunk_bytes=CHUNK_BYTES):
+    '''
+    Filters a (points,) or (spectra, points) array of dBm power and removes its baseline, returning a new array or
+    writing into out, which may be rows itself. Work is split so the temporaries stay around chunk_bytes: sweeps of
+    many spectra are processed a block of spectra at a time, and a single spectrum larger than chunk_bytes in pieces
+    along the wavelength axis that overlap by the reach of the filter.
+    '''
+    if settings.filter not in FILTERS:
+        raise ValueError(f"Unknown filter {settings.filter!r}, expected one of {', '.join(FILTERS)}")
+    if settings.window < 1:
+        raise ValueError("Filter window must be at least one sample")
+    rows = np.asarray(rows)
+    if out is None:
+        out = np.empty(rows.shape, dtype=rows.dtype if np.issubdtype(rows.dtype, np.floating) else np.float64)
+    points = rows.shape[-1]
+    if points == 0:
+        return out
+
+    #Blocks are views of rows and out, a single spectrum is one block
+    flat_rows = rows.reshape(-1, points)
+    flat_out = out.reshape(-1, points)
+    span = max(1, chunk_bytes // 8)
+    block = max(1, span // points)
+    with stage('preprocess', filter=settings.filter, spectra=len(flat_rows), points=points):
+        for first in range(0, len(flat_rows), block):
+            block_rows = flat_rows[first:first + block]
+            block_out = flat_out[first:first + block]
+            if points <= span:
+                block_out[:] = _filter_block(block_rows, settings, _filter_window(settings, points))
+            else:
+                _filter_long(block_rows[0], block_out[0], settings, span)
+            if settings.baseline is not None:
+                coefficients = _baseline_coefficients(block_out, settings.baseline, settings.kind, span)
+                _remove_baseline(block_out, block_out, coefficients, max(1, span // len(block_out)))
+    return out
+
+@memoize()
+def preprocess(data, settings):
+    '''
+    Returns the spectrum with its power filtered and its baseline removed as a new Spectrum sharing the wavelength array.
+    Results are cached by spectrum content and settings, so analyses rerun on the same spectrum reuse the filtered one.
+    '''
+    spectrum = as_spectrum(data)
+    if not settings.active:
+        return spectrum
+    return Spectrum(spectrum.wavelength, preprocess_rows(spectrum.power, settings), spectrum.label)
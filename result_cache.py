@@ -0,0 +1,126 @@
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from spectrum import Spectrum, as_spectrum
+
+#Default memory budget for cached analysis results
+MAX_RESULT_BYTES = int(os.environ.get('SPECTRAL_ANALYZER_RESULT_BYTES', 256 * 1024**2))
+
+def _result_size(value):
+    '''
+    Approximate memory held by a result, counting the arrays it contains.
+    '''
+    if isinstance(value, np.ndarray):
+        #A view keeps the whole array it was sliced from alive
+        return value.base.nbytes if isinstance(value.base, np.ndarray) else value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_result_size(item) for item in value) + 64
+    if isinstance(value, Spectrum):
+        return sum(_result_size(view) for view in value.views().values()) + 64
+    return 64
+
+def _freeze(value):
+    '''
+    Marks the arrays of a cached result read only, since every later caller gets the same objects.
+    '''
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+
+class ResultCache:
+    '''
+    Thread safe LRU cache of analysis results with a memory budget and hit/miss counters.
+    '''
+    def __init__(self, max_bytes=MAX_RESULT_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns (True, result) for a cached key and (False, None) otherwise.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        size = _result_size(value)
+        if size > self.max_bytes:
+            return
+        _freeze(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            #Evict least recently used results until the budget is met
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def items(self):
+        '''
+        Returns a snapshot of the cached (key, result) pairs, least recently used first.
+        '''
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._entries.items()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+#Shared cache used by the analysis functions
+result_cache = ResultCache()
+
+def _data_key(data):
+    '''
+    Identifies spectrum data by content. Files are identified by path, size and modification time so they do not
+    have to be read to look up a result.
+    '''
+    if isinstance(data, (str, os.PathLike)):
+        stat = os.stat(data)
+        return ('file', os.path.abspath(data), stat.st_size, stat.st_mtime_ns)
+    return ('spectrum', as_spectrum(data).content_hash)
+
+def memoize(spectra=1, cache=result_cache):
+    '''
+    Caches the results of an analysis function whose first spectra arguments are spectrum data and whose remaining
+    arguments are hashable parameters. Non-file data is converted to Spectrum before the call, so the content hash is
+    computed only once per spectrum.
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            data = [arg if isinstance(arg, (str, os.PathLike, Spectrum)) else as_spectrum(arg) for arg in args[:spectra]]
+            key = (fn.__qualname__, tuple(_data_key(item) for item in data), args[spectra:],
+                   tuple(sorted(kwargs.items())))
+            found, result = cache.get(key)
+            if found:
+                return result
+            result = fn(*data, *args[spectra:], **kwargs)
+            cache.put(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -1,7 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple
+
 import numpy as np
-import scipy.signal
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+
+from instrumentation import stage
+from preprocess import preprocess
+from result_cache import memoize
+from spectrum import Spectrum, as_spectrum
 
 def cos_func(x, D, E):
     '''
@@ -10,137 +16,864 @@ def cos_func(x, D, E):
     y = D*np.cos(E*x)
     return y
 
-def compute_error(E):
+def cos_jacobian(x, D, E):
     '''
-    Used to compute an error term between fitted curve and actual data.
+    Partial derivatives of cos_func with respect to D and E.
     '''
+    x = np.asarray(x, dtype=float)
+    argument = E * x
+    return np.stack(np.broadcast_arrays(np.cos(argument), -D * x * np.sin(argument)), axis=-1)
 
-    #E corresponds to cosine argument guess
-    guess = [1, E]
-    parameters, covariance = curve_fit(cos_func, dataX, dataY_norm, p0=guess)
-    fit_D = parameters[0]
-    fit_E = parameters[1]
-    fit_cosine = cos_func(dataX, fit_D, fit_E)
+def mzi_func(x, D, E, phase, offset):
+    '''
+    Mach-Zehnder fringes with a phase and a constant offset.
+    '''
+    return offset + D * np.cos(E * x + phase)
 
-    #Calculate sum of squares error
-    error = np.sum((dataY_norm - fit_cosine)**2)
-    return error
+def mzi_jacobian(x, D, E, phase, offset):
+    x = np.asarray(x, dtype=float)
+    argument = E * x + phase
+    sine = np.sin(argument)
+    return np.stack(np.broadcast_arrays(np.cos(argument), -D * x * sine, -D * sine, np.ones_like(argument)), axis=-1)
 
-#Enable use on arrays
-compute_error = np.vectorize(compute_error)
+def lorentzian_func(x, center, linewidth, depth, offset):
+    '''
+    Lorentzian resonance dip of full width at half maximum linewidth on a flat background. A negative depth gives a peak.
+    '''
+    u = 2 * (x - center) / linewidth
+    return offset * (1 - depth / (1 + u**2))
 
-def spectral_curve_fit(data, start, stop):
+def lorentzian_jacobian(x, center, linewidth, depth, offset):
+    u = 2 * (np.asarray(x, dtype=float) - center) / linewidth
+    shape = 1 / (1 + u**2)
+    slope = offset * depth * 2 * u * shape**2 / linewidth
+    return np.stack(np.broadcast_arrays(-2 * slope, -u * slope, -offset * shape, 1 - depth * shape), axis=-1)
+
+def airy_func(x, center, FSR, loss, coupling, scale):
+    '''
+    Through port of an all-pass ring resonator with round trip amplitude transmission loss and self coupling coupling,
+    resonant at center with free spectral range FSR.
+    '''
+    cosine = np.cos(2 * np.pi * (x - center) / FSR)
+    product = loss * coupling
+    numerator = loss**2 - 2 * product * cosine + coupling**2
+    denominator = 1 - 2 * product * cosine + product**2
+    return scale * numerator / denominator
+
+def airy_jacobian(x, center, FSR, loss, coupling, scale):
+    phase = 2 * np.pi * (np.asarray(x, dtype=float) - center) / FSR
+    cosine = np.cos(phase)
+    sine = np.sin(phase)
+    product = loss * coupling
+    numerator = loss**2 - 2 * product * cosine + coupling**2
+    denominator = 1 - 2 * product * cosine + product**2
+
+    #Quotient rule for each parameter, the phase enters numerator and denominator identically
+    d_phase = scale * 2 * product * sine * (denominator - numerator) / denominator**2
+    d_loss = scale * ((2 * loss - 2 * coupling * cosine) * denominator
+                      - numerator * (2 * loss * coupling**2 - 2 * coupling * cosine)) / denominator**2
+    d_coupling = scale * ((2 * coupling - 2 * loss * cosine) * denominator
+                          - numerator * (2 * loss**2 * coupling - 2 * loss * cosine)) / denominator**2
+    return np.stack(np.broadcast_arrays(-2 * np.pi / FSR * d_phase, -phase / FSR * d_phase, d_loss, d_coupling,
+                                        numerator / denominator), axis=-1)
+
+def airy_linewidth(center, FSR, loss, coupling, scale):
     '''
-    Used to fit a cosine curve to spectral data.
+    Full width at half maximum of an all-pass ring resonance, FSR * (1 - a*r) / (pi * sqrt(a*r)).
     '''
-    #Make data accessible to compute_error function
-    global dataX
-    global dataY_norm
-    dataX=np.array(data.iloc[1:][0])   # Definition of the array for the wavelenghts in nanometers
-    dataY=np.array(data.iloc[1:][1])   # Definition of the power in dBm
+    product = loss * coupling
+    return FSR * (1 - product) / (np.pi * np.sqrt(product))
 
-    #Linearize and normalize data
-    dataY_linear = 10 ** (dataY / 10) * 1000
-    Max_Trans = np.max(dataY_linear)
-    dataY_norm = (dataY_linear / Max_Trans) * 2 - 1
+def _dip_guess(x, y):
+    '''
+    Background level, extremum position, relative depth and full width at half depth of a single resonance in each row
+    of x and y.
+    '''
+    edge = max(1, y.shape[-1] // 10)
+    background = np.median(np.concatenate((y[..., :edge], y[..., -edge:]), axis=-1), axis=-1)
+    deviation = y - background[..., None]
+    index = np.argmax(np.abs(deviation), axis=-1)[..., None]
+    center = np.take_along_axis(x, index, axis=-1)[..., 0]
+    extreme = np.take_along_axis(y, index, axis=-1)[..., 0]
+    depth = 1 - extreme / background
+
+    #Samples beyond half the depth, times the median spacing
+    spacing = np.median(np.abs(np.diff(x, axis=-1)), axis=-1)
+    half = np.abs(deviation) > np.abs(extreme - background)[..., None] / 2
+    width = np.maximum(np.count_nonzero(half, axis=-1), 1) * spacing
+    return background, center, depth, width
+
+def lorentzian_guess(x, y, **hints):
+    background, center, depth, width = _dip_guess(x, y)
+    return np.stack((center, width, depth, background), axis=-1)
+
+def airy_guess(x, y, FSR=None, **hints):
+    '''
+    Starting ring parameters from the depth and width of the dip. The ring is assumed to be under coupled, loss < coupling.
+    '''
+    background, center, depth, width = _dip_guess(x, y)
+    if FSR is None:
+        FSR = 20 * width
+    FSR = np.broadcast_to(FSR, center.shape)
+
+    #Invert linewidth = FSR (1 - ar) / (pi sqrt(ar)) for ar, then the on-resonance transmission for r - a
+    k = np.pi * width / FSR
+    product = ((np.sqrt(k**2 + 4) - k) / 2)**2
+    difference = np.sqrt(np.clip(1 - depth, 0, 0.999)) * (1 - product)
+    loss = (np.sqrt(difference**2 + 4 * product) - difference) / 2
+    return np.stack((center, FSR, loss, loss + difference, background), axis=-1)
+
+def mzi_guess(x, y, **hints):
+    '''
+    Starting fringe parameters from the periodogram of each row.
+    '''
+    guesses = []
+    for row_x, row_y in zip(np.atleast_2d(x), np.atleast_2d(y)):
+        offset = np.mean(row_y)
+        E, _ = estimate_frequency(row_x, row_y - offset)
+        basis = np.column_stack((np.cos(E * row_x), np.sin(E * row_x)))
+        (a, b), *_ = np.linalg.lstsq(basis, row_y - offset, rcond=None)
+        guesses.append((np.hypot(a, b), E, -np.arctan2(b, a), offset))
+    return np.array(guesses).reshape(np.shape(x)[:-1] + (4,))
+
+def cos_guess(x, y, **hints):
+    guesses = [estimate_frequency(row_x, row_y)[::-1] for row_x, row_y in zip(np.atleast_2d(x), np.atleast_2d(y))]
+    return np.array(guesses).reshape(np.shape(x)[:-1] + (2,))
+
+class FitModel(NamedTuple):
+    '''
+    A fit model: the model function f(x, *parameters), its analytic Jacobian with the parameters along the last axis,
+    the parameter names, a starting guess guess(x, y, **hints) and, for resonance models, the linewidth as a function
+    of the parameters. Functions broadcast, so the parameters may be columns of shape (rows, 1) to evaluate many fits
+    at once.
+    '''
+    name: str
+    function: object
+    jacobian: object
+    parameters: tuple
+    guess: object
+    linewidth: object = None
 
-    #Initialize array of guess parameters to iterate over and compute errors
-    param_list = np.linspace(start, stop, 100)
-    errors = compute_error(param_list)
+#Registered fit models by name
+MODELS = {}
 
-    #Find parameter corresponding to lowest error
-    min_loc = np.where(errors == min(errors))[0][0]
-    optimal_params = [1, param_list[min_loc]]
+def register_model(model):
+    '''
+    Adds a FitModel to the registry, replacing any model of the same name.
+    '''
+    MODELS[model.name] = model
+    return model
 
-    parameters, covariance = curve_fit(cos_func, dataX, dataY_norm, p0=optimal_params)
-    fit_D = parameters[0]  # Fit for the amplitue
-    fit_E = parameters[1]  # Fit for the argument of the cosine
-    fit_cosine = cos_func(dataX, fit_D, fit_E)
-    return dataX, dataY_norm, fit_cosine
+def get_model(model):
+    '''
+    Returns a registered model by name, or model itself if it already is a FitModel.
+    '''
+    if isinstance(model, FitModel):
+        return model
+    if model not in MODELS:
+        raise ValueError(f"Unknown fit model {model!r}, expected one of {', '.join(MODELS)}")
+    return MODELS[model]
+
+register_model(FitModel('cosine', cos_func, cos_jacobian, ('D', 'E'), cos_guess))
+register_model(FitModel('mzi', mzi_func, mzi_jacobian, ('D', 'E', 'phase', 'offset'), mzi_guess))
+register_model(FitModel('lorentzian', lorentzian_func, lorentzian_jacobian, ('center', 'linewidth', 'depth', 'offset'),
+                        lorentzian_guess, lambda center, linewidth, depth, offset: np.abs(linewidth)))
+register_model(FitModel('airy', airy_func, airy_jacobian, ('center', 'FSR', 'loss', 'coupling', 'scale'), airy_guess,
+                        airy_linewidth))
+
+def dominant_frequency(values, spacing, start=0, stop=0):
+    '''
+    Returns the angular frequency (rad/nm) of the periodogram peak of evenly spaced values and the ratio of that peak to
+    the median of the periodogram, which is large for periodic data and small for noise.
+    If stop > start, only frequencies inside [start, stop] are considered.
+    '''
+    #scipy is imported on first use rather than with the module, it dominates application startup
+    from scipy.fft import rfft, rfftfreq, next_fast_len
+
+    n = len(values)
+    centered = values - np.mean(values)
+
+    #Zero pad so the peak is sampled finely enough for interpolation
+    n_fft = next_fast_len(2 * n)
+    spectrum = np.abs(rfft(centered, n_fft))
+    frequencies = 2 * np.pi * rfftfreq(n_fft, spacing)
+
+    #Ignore the DC bin and anything outside of the requested band
+    valid = frequencies > 0
+    if stop > start:
+        valid &= (frequencies >= start) & (frequencies <= stop)
+    if not valid.any():
+        valid = frequencies > 0
+    peak = np.flatnonzero(valid)[np.argmax(spectrum[valid])]
+
+    #Parabolic interpolation of the log magnitude for sub-bin precision
+    frequency = frequencies[peak]
+    if 0 < peak < len(spectrum) - 1:
+        offset, _ = parabolic_offset(*np.log(spectrum[peak - 1:peak + 2] + 1e-300))
+        frequency += offset * (frequencies[1] - frequencies[0])
+    return frequency, spectrum[peak] / max(np.median(spectrum[1:]), np.finfo(float).tiny)
+
+def estimate_frequency(dataX, dataY_norm, start=0, stop=0):
+    '''
+    Estimates the cosine argument (rad/nm) and amplitude of normalized data from its periodogram.
+    If stop > start, only frequencies inside [start, stop] are considered.
+    '''
+    spacing = abs(dataX[-1] - dataX[0]) / (len(dataX) - 1)
+    frequency, _ = dominant_frequency(dataY_norm, spacing, start, stop)
+
+    #Least squares projection onto cos/sin at the estimated frequency gives amplitude and phase
+    center = 0.5 * (dataX[0] + dataX[-1])
+    argument = frequency * (dataX - center)
+    basis = np.column_stack((np.cos(argument), np.sin(argument)))
+    (a, b), *_ = np.linalg.lstsq(basis, dataY_norm, rcond=None)
+    amplitude = np.hypot(a, b)
+    phase = -np.arctan2(b, a)
+
+    #cos_func has no phase term, so fold the phase into a small change of the argument around the center
+    offset = np.angle(np.exp(1j * (phase - frequency * center)))
+    return frequency + offset / center, amplitude
+
+def grid_search(dataX, dataY_norm, E, start=0, stop=0, max_points=16384, block=64):
+    '''
+    Evaluates the fit error for every phase-consistent cosine argument within the zero padded periodogram bin around E,
+    block candidates at a time so memory does not grow with the number of candidates, and returns the best argument
+    and amplitude.
+    '''
+    #Decimate, the coarse search does not need every sample
+    step = max(1, len(dataX) // max_points)
+    x = dataX[::step]
+    y = dataY_norm[::step]
+
+    #Neighbouring arguments that keep the phase at the center of the sweep differ by 2*pi/center. The periodogram is
+    #zero padded to twice the sweep, so its bins are pi/span wide
+    center = 0.5 * (dataX[0] + dataX[-1])
+    span = abs(dataX[-1] - dataX[0])
+    k = int(np.ceil(abs(center) / span / 2))
+    candidates = E + 2 * np.pi * np.arange(-k, k + 1) / center
+    if stop > start:
+        candidates = candidates[(candidates >= start) & (candidates <= stop)]
+        if len(candidates) == 0:
+            candidates = np.array([E])
+
+    #Sum of squares error for each candidate with its optimal amplitude, keeping only the best so far
+    best_error = np.inf
+    for first in range(0, len(candidates), block):
+        cosines = np.cos(np.outer(candidates[first:first + block], x))
+        projection = cosines @ y
+        energy = np.einsum('ij,ij->i', cosines, cosines)
+        errors = y @ y - projection**2 / energy
+        index = np.argmin(errors)
+        if errors[index] < best_error:
+            best_error = errors[index]
+            best = candidates[first + index], projection[index] / energy[index]
+    return best
+
+class FitResult(NamedTuple):
+    '''
+    Result of a cosine fit: fitted [D, E] parameters, their covariance, sum of squares residual and the number of
+    solver function evaluations.
+    '''
+    parameters: np.ndarray
+    covariance: np.ndarray
+    residual: float
+    nfev: int
 
+def fit_cosine(dataX, dataY_norm, start, stop, grid=True):
+    '''
+    Fits cos_func to normalized data. This function keeps no state, so it is safe to call from threads and worker
+    processes.
+    The starting cosine argument is estimated from the periodogram of the data and, if grid is set, a vectorized search
+    around it. A single curve_fit call then refines the parameters.
+    '''
+    from scipy.optimize import curve_fit
+
+    dataX = np.asarray(dataX, dtype=float)
+    dataY_norm = np.asarray(dataY_norm, dtype=float)
+
+    #Estimate starting parameters
+    with stage('fit_estimate', points=len(dataX)):
+        E, D = estimate_frequency(dataX, dataY_norm, start, stop)
+    if grid:
+        with stage('fit_grid', points=len(dataX)):
+            E, D = grid_search(dataX, dataY_norm, E, start, stop)
+
+    with stage('fit_refine', points=len(dataX)) as timing:
+        parameters, covariance, info, message, status = curve_fit(cos_func, dataX, dataY_norm, p0=[D, E],
+                                                                  jac=cos_jacobian, full_output=True)
+        timing['nfev'] = int(info['nfev'])
+    residual = np.sum((dataY_norm - cos_func(dataX, *parameters))**2)
+    return FitResult(parameters, covariance, float(residual), int(info['nfev']))
+
+def _fit_arrays(arrays, start, stop, grid):
+    '''
+    Process pool entry point for fit_many.
+    '''
+    spectrum = Spectrum(*arrays)
+    return fit_cosine(spectrum.wavelength, spectrum.normalized, start, stop, grid)
 
-def temperature_shift(data1, data2, start, end):
+def fit_many(spectra, start, stop, workers=None, grid=True):
+    '''
+    Fits a cosine curve to each spectrum using a pool of worker processes. Spectra may be Spectrum objects, DataFrames
+    or (wavelength, dBm) array pairs. Returns a list of FitResult in input order.
+    '''
+    #Convert to plain arrays up front so only numeric data is sent to the workers
+    arrays = []
+    for data in spectra:
+        spectrum = as_spectrum(data)
+        arrays.append((spectrum.wavelength, spectrum.power))
+
+    if workers == 1:
+        return [_fit_arrays(item, start, stop, grid) for item in arrays]
+    fit = partial(_fit_arrays, start=start, stop=stop, grid=grid)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fit, arrays))
+
+class CurveFitResult(NamedTuple):
+    '''
+    Result of fit_spectrum: the wavelength and normalized power data, the fitted curve on the same wavelengths, the
+    fitted [D, E] parameters and the number of solver function evaluations.
     '''
-    Used to calculate temperature shift of two spectral resonance peaks.
+    wavelength: np.ndarray
+    normalized: np.ndarray
+    fitted_curve: np.ndarray
+    parameters: np.ndarray
+    nfev: int
+
+@memoize()
+def fit_spectrum(data, start, stop, grid=True):
     '''
-    dataX_1 = np.array(data1.iloc[1:][0])  # Definition of the array for the wavelenghts in nanometers
-    dataY_1 = np.array(data1.iloc[1:][1])  # Definition of the power in dBm
+    Fits a cosine curve to spectral data and returns a CurveFitResult, which also holds the fitted parameters and the
+    number of solver evaluations. Results are cached by spectrum content and parameters.
+    '''
+    spectrum = as_spectrum(data)
+    dataX = spectrum.wavelength   # Definition of the array for the wavelenghts in nanometers
+    dataY_norm = spectrum.normalized   # Linearized and normalized power
 
-    dataX_2 = np.array(data2.iloc[1:][0])  # Definition of the array for the wavelenghts in nanometers
-    dataY_2 = np.array(data2.iloc[1:][1])  # Definition of the power in dBm
+    result = fit_cosine(dataX, dataY_norm, start, stop, grid)
+    fit_D = result.parameters[0]  # Fit for the amplitue
+    fit_E = result.parameters[1]  # Fit for the argument of the cosine
+    fitted_curve = cos_func(dataX, fit_D, fit_E)
+    return CurveFitResult(dataX, dataY_norm, fitted_curve, result.parameters, result.nfev)
 
-    # Partition data1 to get just the first minimum
-    dataX1_peak1 = dataX_1[(dataX_1 > start) & (dataX_1 < end)]
-    dataY1_peak1 = dataY_1[(dataX_1 > start) & (dataX_1 < end)]
+def spectral_curve_fit(data, start, stop, grid=True):
+    '''
+    Used to fit a cosine curve to spectral data. Returns the (dataX, dataY_norm, fit_cosine) tuple, use fit_spectrum
+    for the fitted parameters and solver evaluations.
+    '''
+    result = fit_spectrum(data, start, stop, grid)
+    return result.wavelength, result.normalized, result.fitted_curve
 
-    # Find minimum, find wavelength corresponding to power minimum
-    power_min = min(dataY1_peak1)
-    dataX1_minimum = dataX1_peak1[dataY1_peak1 == power_min]
+def common_grid(spectra, start=None, end=None, points=None):
+    '''
+    Returns a uniform wavelength grid covering the overlap of the spectra, optionally limited to [start, end], with the
+    finest median sample spacing among them or with the given number of points. Raises ValueError if the spectra do not
+    overlap.
+    '''
+    if any(len(spectrum) == 0 for spectrum in spectra):
+        raise ValueError("Cannot build a grid for an empty spectrum")
+
+    #Spectrum keeps its wavelengths in increasing order, so the ends are the first and last samples
+    low = max(spectrum.wavelength[0] for spectrum in spectra)
+    high = min(spectrum.wavelength[-1] for spectrum in spectra)
+    if start is not None:
+        low = max(low, start)
+    if end is not None:
+        high = min(high, end)
+    if high <= low:
+        raise ValueError("Spectra do not overlap in the selected band")
+    if points is not None:
+        return np.linspace(low, high, points)
+    step = min(np.median(np.abs(np.diff(spectrum.wavelength))) for spectrum in spectra)
+    return np.linspace(low, high, int(round((high - low) / step)) + 1)
+
+def resample(spectrum, grid):
+    '''
+    Interpolates the dBm power of a spectrum onto a grid.
+    '''
+    return np.interp(grid, spectrum.wavelength, spectrum.power)
+
+def resample_many(spectra, grid, dtype=np.float64):
+    '''
+    Interpolates the dBm power of each spectrum onto a grid, into one contiguous (spectra, points) array of dtype.
+    Spectra already sampled on the grid are copied without interpolation.
+    '''
+    spectra = [as_spectrum(data) for data in spectra]
+    rows = np.empty((len(spectra), len(grid)), dtype=dtype)
+    with stage('resample', spectra=len(spectra), points=len(grid)):
+        for row, spectrum in zip(rows, spectra):
+            if len(spectrum) == len(grid) and np.array_equal(spectrum.wavelength, grid):
+                row[:] = spectrum.power
+            else:
+                row[:] = np.interp(grid, spectrum.wavelength, spectrum.power)
+    return rows
+
+def parabolic_offset(left, middle, right):
+    '''
+    Fits a parabola through an extremum and its two neighbours and returns the offset of its vertex from the middle
+    sample, in samples and clipped to half a sample, and the value at the vertex. Works elementwise on arrays.
+    '''
+    curvature = left - 2 * middle + right
+    offset = np.divide(0.5 * (left - right), curvature, out=np.zeros_like(curvature), where=curvature != 0)
+    offset = np.clip(offset, -0.5, 0.5)
+    return offset, middle - 0.25 * (left - right) * offset
+
+#Periodogram peak to median ratio above which a reference spectrum is treated as periodic
+PERIODIC_PROMINENCE = 10
 
-    # Partition data2 to get just the first minimum
-    dataX2_peak1 = dataX_2[(dataX_2 > start) & (dataX_2 < end)]
-    dataY2_peak1 = dataY_2[(dataX_2 > start) & (dataX_2 < end)]
+#Normalized correlation maxima this close to the highest one count as equally good
+XCORR_PEAK_TOLERANCE = 0.01
+
+def _overlap_energy(rows, lags, leading):
+    '''
+    Sum of squares of each row over the samples that overlap at each lag. For the leading signal the overlap at lag k
+    is [0, n - k) for k >= 0 and [-k, n) for k < 0, and the other way round for the trailing signal.
+    '''
+    n = rows.shape[1]
+    cumulative = np.concatenate((np.zeros((len(rows), 1)), np.cumsum(rows**2, axis=1)), axis=1)
+    total = cumulative[:, -1:]
+    shift = np.abs(lags)
+    if leading:
+        return np.where(lags >= 0, cumulative[:, n - shift], total - cumulative[:, shift])
+    return np.where(lags >= 0, total - cumulative[:, shift], cumulative[:, n - shift])
+
+def xcorr_shifts(reference, rows, step, max_shift=None, block=256):
+    '''
+    Estimates the shift in nm of each row of rows relative to reference from the peak of their normalized FFT
+    cross-correlation. Both are 2-D and sampled on the same uniform grid with spacing step; a single reference row is
+    shared by all rows. The peak is refined to sub-sample precision by parabolic interpolation. max_shift limits the
+    lags searched. By default it is a quarter of the band, and under half the period of the first reference if that is
+    periodic, since the correlation of periodic spectra repeats every FSR. Of several maxima within
+    XCORR_PEAK_TOLERANCE of the highest, the one nearest zero lag is taken. Rows whose peak lies on the largest lag
+    searched get NaN. Rows are transformed block rows at a time to bound memory. Raises ValueError for rows of fewer than
+    three samples.
+    '''
+    from scipy.fft import rfft, irfft, next_fast_len
+
+    reference = np.atleast_2d(reference)
+    rows = np.atleast_2d(rows)
+    n = rows.shape[1]
+    if n < 3:
+        raise ValueError("Cross-correlation needs at least three samples in the band")
+
+    #Only the lags that are searched are gathered from the circular correlation. By default these are limited to a
+    #quarter of the band, beyond that too few samples overlap for a reliable estimate
+    if max_shift is None:
+        limit = n // 4
+        frequency, prominence = dominant_frequency(reference[0], step)
+        if prominence > PERIODIC_PROMINENCE:
+            limit = min(limit, int(np.pi / frequency / step) - 1)
+    else:
+        limit = int(np.ceil(max_shift / step))
+    limit = min(max(limit, 1), n - 2)
+    lags = np.arange(-limit, limit + 1)
+
+    #Zero padding to at least 2n keeps the correlation linear rather than circular
+    n_fft = next_fast_len(2 * n)
+    columns = lags % n_fft
+    reference = reference - reference.mean(axis=1, keepdims=True)
+    reference_fft = np.conj(rfft(reference, n_fft, axis=1, workers=-1))
+    reference_energy = _overlap_energy(reference, lags, leading=True)
+
+    shifts = np.empty(len(rows))
+    for first in range(0, len(rows), block):
+        chunk = rows[first:first + block]
+        chunk = chunk - chunk.mean(axis=1, keepdims=True)
+        chunk_fft = rfft(chunk, n_fft, axis=1, workers=-1)
+        shared = len(reference) == 1
+        reference_chunk = reference_fft if shared else reference_fft[first:first + block]
+        energy = reference_energy if shared else reference_energy[first:first + block]
+        correlation = irfft(reference_chunk * chunk_fft, n_fft, axis=1, workers=-1)[:, columns]
+
+        #Normalizing by the energy of the overlapping parts keeps windowed spectra from being pulled towards zero
+        #shift, and an exact copy always peaks at zero lag
+        energy = energy * _overlap_energy(chunk, lags, leading=False)
+        correlation /= np.sqrt(np.maximum(energy, np.finfo(float).tiny))
+
+        #Candidates are the local maxima close to the highest one, the global maximum always among them
+        index = np.arange(len(chunk))
+        highest = np.argmax(correlation, axis=1)
+        candidates = np.zeros(correlation.shape, dtype=bool)
+        middle = correlation[:, 1:-1]
+        candidates[:, 1:-1] = (middle >= correlation[:, :-2]) & (middle >= correlation[:, 2:])
+        candidates[index, highest] = True
+        candidates &= correlation >= correlation[index, highest][:, None] - XCORR_PEAK_TOLERANCE
+        best = np.argmin(np.where(candidates, np.abs(lags), len(lags)), axis=1)
+        inner = np.clip(best, 1, len(lags) - 2)
+        offset, _ = parabolic_offset(correlation[index, inner - 1], correlation[index, inner],
+                                     correlation[index, inner + 1])
+
+        #A peak on the first or last lag searched may lie further out, so its lag is not a shift estimate
+        shifts[first:first + block] = np.where(best == inner, (lags[inner] + offset) * step, np.nan)
+    return shifts
+
+def estimate_shift(data1, data2, start=None, end=None, max_shift=None):
+    '''
+    Estimates the wavelength shift in nm of spectrum 2 relative to spectrum 1 by FFT cross-correlation over the whole
+    overlapping sweep or the band [start, end]. Positive values mean spectrum 2 is shifted to longer wavelengths.
+    '''
+    return estimate_shifts([data1], [data2], start, end, max_shift)[0]
 
-    # Find minimum, find wavelength corresponding to power minimum
-    power_min = min(dataY2_peak1)
-    dataX2_minimum = dataX2_peak1[dataY2_peak1 == power_min]
+def estimate_shifts(references, spectra, start=None, end=None, max_shift=None):
+    '''
+    Estimates the shift of each spectrum relative to its reference in one batched FFT. A single reference may be given
+    for all spectra. All spectra are resampled onto one common grid first.
+    '''
+    references = [as_spectrum(data) for data in references]
+    spectra = [as_spectrum(data) for data in spectra]
+    grid = common_grid(references + spectra, start, end)
+    reference_rows = resample_many(references, grid)
+    rows = resample_many(spectra, grid)
+    return xcorr_shifts(reference_rows, rows, grid[1] - grid[0], max_shift)
+
+class ShiftResult(NamedTuple):
+    '''
+    Result of temperature_shift: the windowed wavelength/power data of both spectra, the wavelengths of their power
+    minima, the minimum power of the second spectrum and the shift between the minima in nm.
+    '''
+    wavelength1: np.ndarray
+    power1: np.ndarray
+    wavelength2: np.ndarray
+    power2: np.ndarray
+    minimum1: float
+    minimum2: float
+    power_min: float
+    shift: float
+
+@memoize(spectra=2)
+def temperature_shift(data1, data2, start, end, method='minimum', max_shift=None, preprocessing=None):
+    '''
+    Used to calculate temperature shift of two spectral resonance peaks. Spectra given as csv file paths are streamed,
+    and only the samples between start and end are kept in memory. Returns a ShiftResult.
+    With method='minimum' the shift is the distance between the lowest samples of the window. With method='xcorr' it is
+    estimated by FFT cross-correlation of the window to sub-sample precision, and is NaN if the correlation peak lies
+    beyond the lags searched. Both spectra are smoothed first if
+    preprocessing settings are given, and the result holds the smoothed windows.
+    Results are cached by spectrum content and parameters.
+    '''
+    spectrum1 = as_spectrum(data1, window=(start, end))
+    spectrum2 = as_spectrum(data2, window=(start, end))
+    if preprocessing is not None and preprocessing.active:
+        spectrum1 = preprocess(spectrum1, preprocessing)
+        spectrum2 = preprocess(spectrum2, preprocessing)
+    dataX_1 = spectrum1.wavelength  # Definition of the array for the wavelenghts in nanometers
+    dataY_1 = spectrum1.power  # Definition of the power in dBm
+
+    dataX_2 = spectrum2.wavelength  # Definition of the array for the wavelenghts in nanometers
+    dataY_2 = spectrum2.power  # Definition of the power in dBm
+
+    with stage('peak_search', analysis='temperature_shift'):
+        # Partition data1 to get just the first minimum
+        window1 = spectrum1.window_slice(start, end)
+        dataX1_peak1 = dataX_1[window1]
+        dataY1_peak1 = dataY_1[window1]
+        if len(dataY1_peak1) == 0:
+            raise ValueError(f"Window contains no samples of {spectrum1.label or 'spectrum 1'}")
+
+        # Find minimum, find wavelength corresponding to power minimum
+        power_min = min(dataY1_peak1)
+        dataX1_minimum = dataX1_peak1[dataY1_peak1 == power_min]
+
+        # Partition data2 to get just the first minimum
+        window2 = spectrum2.window_slice(start, end)
+        dataX2_peak1 = dataX_2[window2]
+        dataY2_peak1 = dataY_2[window2]
+        if len(dataY2_peak1) == 0:
+            raise ValueError(f"Window contains no samples of {spectrum2.label or 'spectrum 2'}")
+
+        # Find minimum, find wavelength corresponding to power minimum
+        power_min = min(dataY2_peak1)
+        dataX2_minimum = dataX2_peak1[dataY2_peak1 == power_min]
 
     # Calculate distance between minima of data to get temperature shift
     shift_distance = dataX2_minimum[0] - dataX1_minimum[0]
+    if method == 'xcorr':
+        with stage('xcorr_shift', points=len(dataX_1)):
+            minimum_shift = shift_distance
+            shift_distance = estimate_shift(spectrum1, spectrum2, start, end, max_shift)
 
-    plt.plot(dataX1_peak1, dataY1_peak1, label='Signal 1')
-    plt.plot(dataX2_peak1, dataY2_peak1, label='Signal 2')
-    plt.hlines(y=power_min, xmin=dataX1_minimum[0], xmax=dataX2_minimum[0], color='black', linestyle='dashed',
-               label='Distance Shift')
-    plt.annotate(f'Shift distance: {round(abs(shift_distance), 3)} nm', xy=(dataX1_minimum[0], power_min + 1))
+            #The default search ends at a quarter of the window, a resonance that moved further is searched again out
+            #to twice the distance between the minima
+            if np.isnan(shift_distance) and max_shift is None and minimum_shift != 0:
+                shift_distance = estimate_shift(spectrum1, spectrum2, start, end, 2 * abs(minimum_shift))
 
-    plt.xlabel("Wavelength (nm)")
-    plt.ylabel("Transmission (dbm)")
-    plt.legend()
-    plt.show()
+    return ShiftResult(dataX1_peak1, dataY1_peak1, dataX2_peak1, dataY2_peak1, dataX1_minimum[0], dataX2_minimum[0],
+                       power_min, shift_distance)
 
-def calculate_FSR(data, peak1_start, peak1_end, peak2_start, peak2_end):
+class FSRResult(NamedTuple):
     '''
-    Used to calculate the free spectral range between two resonance peaks.
+    Result of calculate_FSR: the analyzed wavelength/linear power data, the two peak windows, the wavelength and power of
+    both peak maxima and the free spectral range in nm.
     '''
+    wavelength: np.ndarray
+    power_linear: np.ndarray
+    windows: tuple
+    peak1: float
+    peak1_power: float
+    peak2: float
+    peak2_power: float
+    FSR: float
+
+@memoize()
+def calculate_FSR(data, peak1_start, peak1_end, peak2_start, peak2_end, preprocessing=None):
+    '''
+    Used to calculate the free spectral range between two resonance peaks. A spectrum given as a csv file path is
+    streamed, and only the samples spanning both peak windows are kept in memory. The spectrum is smoothed first if
+    preprocessing settings are given. Returns an FSRResult. Results are cached by spectrum content and parameters.
+    '''
+    window = (min(peak1_start, peak2_start), max(peak1_end, peak2_end))
+    spectrum = as_spectrum(data, window=window)
+    if preprocessing is not None and preprocessing.active:
+        spectrum = preprocess(spectrum, preprocessing)
+    dataX = spectrum.wavelength  # Definition of the array for the wavelenghts in nanometers
+    dataY_linear = spectrum.linear  # Power in microwatts
 
-    dataX = np.array(data.iloc[1:][0])  # Definition of the array for the wavelenghts in nanometers
-    dataY = np.array(data.iloc[1:][1])  # Definition of the power in dBm
-    dataY_linear = 10 ** (dataY / 10) * 1000
-
-    dataX_peak1 = dataX[(dataX > peak1_start) & (dataX < peak1_end)]
-    dataY_peak1 = dataY_linear[(dataX > peak1_start) & (dataX < peak1_end)]
+    with stage('peak_search', analysis='FSR'):
+        window1 = spectrum.window_slice(peak1_start, peak1_end)
+        dataX_peak1 = dataX[window1]
+        dataY_peak1 = dataY_linear[window1]
 
-    # Calculate the maximum of peak 1
-    max_peak1 = np.max(dataY_peak1)
+        # Calculate the maximum of peak 1
+        max_peak1 = np.max(dataY_peak1)
 
-    # Calculate wavelength associated with maximum of peak 1
-    max_wavelength1 = dataX_peak1[dataY_peak1 == max_peak1]
+        # Calculate wavelength associated with maximum of peak 1
+        max_wavelength1 = dataX_peak1[dataY_peak1 == max_peak1]
 
-    # Slice data based for peak 2
-    dataX_peak2 = dataX[(dataX > peak2_start) & (dataX < peak2_end)]
-    dataY_peak2 = dataY_linear[(dataX > peak2_start) & (dataX < peak2_end)]
+        # Slice data based for peak 2
+        window2 = spectrum.window_slice(peak2_start, peak2_end)
+        dataX_peak2 = dataX[window2]
+        dataY_peak2 = dataY_linear[window2]
 
-    # Calculate the maximum of peak 2
-    max_peak2 = np.max(dataY_peak2)
+        # Calculate the maximum of peak 2
+        max_peak2 = np.max(dataY_peak2)
 
-    # Calculate wavelength associated with maximum of peak 2
-    max_wavelength2 = dataX_peak2[dataY_peak2 == max_peak2]
+        # Calculate wavelength associated with maximum of peak 2
+        max_wavelength2 = dataX_peak2[dataY_peak2 == max_peak2]
 
     # Calculate differences between peaks
 
     FSR = max_wavelength2 - max_wavelength1
 
-    plt.plot(dataX, dataY_linear, label='Long MZI', color='blue')
-    plt.hlines(y=max_peak2, xmin=max_wavelength1, xmax=max_wavelength2, color='blue', linestyle='dashed', label='FSR')
-    plt.axvline(x=peak1_start, linestyle='dashed', color='black')
-    plt.axvline(x=peak1_end, linestyle='dashed', color='black')
-    plt.axvline(x=peak2_start, linestyle='dashed', color='black')
-    plt.axvline(x=peak2_end, linestyle='dashed', color='black')
-
-    # plt.annotate(f'Shift distance: {round(FSR[0], 3)} nm', xy=(max_wavelength1, max_peak1 + .2))
-    plt.text(max_wavelength1, max_peak1 + .5, f'Shift distance: {round(FSR[0], 3)} nm',
-             bbox={'facecolor': 'white', 'pad': 4})
-    plt.xlabel("Wavelength (nm)")
-    plt.ylabel("Transmission (uW)")
-    plt.show()
+    return FSRResult(dataX, dataY_linear, (peak1_start, peak1_end, peak2_start, peak2_end), max_wavelength1[0],
+                     max_peak1, max_wavelength2[0], max_peak2, FSR[0])
+
+class ResonanceResult(NamedTuple):
+    '''
+    Result of find_resonances: wavelength (nm), power (dBm), extinction ratio (dB) and full width at half maximum (nm) of
+    each resonance, and the free spectral range between each adjacent pair (nm).
+    '''
+    positions: np.ndarray
+    power: np.ndarray
+    extinction_ratio: np.ndarray
+    widths: np.ndarray
+    FSR: np.ndarray
+
+@memoize()
+def find_resonances(data, prominence=3, min_width=None, max_width=None, distance=None, kind='dip', preprocessing=None):
+    '''
+    Finds every resonance of a spectrum in one pass with scipy.signal.find_peaks. Resonances are dips in transmission
+    unless kind is 'peak'. prominence is the minimum extinction ratio in dB; min_width, max_width and distance are in nm.
+    Positions are refined to sub-sample precision by parabolic interpolation, and widths are measured on linear power.
+    The spectrum is smoothed first if preprocessing settings are given.
+    '''
+    import scipy.signal
+
+    spectrum = as_spectrum(data)
+    if preprocessing is not None and preprocessing.active:
+        spectrum = preprocess(spectrum, preprocessing)
+    dataX = spectrum.wavelength
+    dataY = spectrum.power
+    sign = -1 if kind == 'dip' else 1
+    if len(dataX) < 3:
+        empty = np.empty(0)
+        return ResonanceResult(empty, empty, empty, empty, empty)
+
+    #find_peaks works in samples, so convert the nm thresholds with the mean sample spacing
+    spacing = abs(dataX[-1] - dataX[0]) / (len(dataX) - 1)
+    width = None
+    if min_width is not None or max_width is not None:
+        width = (None if min_width is None else min_width / spacing, None if max_width is None else max_width / spacing)
+    if distance is not None:
+        distance = max(distance / spacing, 1)
+    with stage('peak_search', analysis='find_resonances', points=len(dataY)) as timing:
+        peaks, properties = scipy.signal.find_peaks(sign * dataY, prominence=prominence, width=width,
+                                                    distance=distance)
+        timing['resonances'] = len(peaks)
+
+    #Parabolic refinement through each extremum and its two neighbours
+    inner = np.clip(peaks, 1, len(dataY) - 2)
+    offset, power = parabolic_offset(dataY[inner - 1], dataY[inner], dataY[inner + 1])
+    positions = np.interp(inner + offset, np.arange(len(dataX)), dataX)
+
+    #Full width at half maximum of the linear response, converted from fractional samples to nm
+    _, _, left_ips, right_ips = scipy.signal.peak_widths(sign * spectrum.linear, peaks, rel_height=0.5)
+    sample_axis = np.arange(len(dataX))
+    widths = np.abs(np.interp(right_ips, sample_axis, dataX) - np.interp(left_ips, sample_axis, dataX))
+
+    return ResonanceResult(positions, power, properties['prominences'], widths, np.diff(positions))
+
+def fit_model(dataX, dataY, model, p0=None, **hints):
+    '''
+    Fits a registered model to one spectrum with curve_fit, using the model's analytic Jacobian. p0 defaults to the
+    model's own guess, which receives hints such as FSR. Returns a FitResult.
+    '''
+    from scipy.optimize import curve_fit
+
+    model = get_model(model)
+    dataX = np.asarray(dataX, dtype=float)
+    dataY = np.asarray(dataY, dtype=float)
+    if p0 is None:
+        p0 = model.guess(dataX, dataY, **hints)
+    with stage('fit_refine', model=model.name, points=len(dataX)) as timing:
+        parameters, covariance, info, message, status = curve_fit(model.function, dataX, dataY, p0=p0,
+                                                                  jac=model.jacobian, full_output=True)
+        timing['nfev'] = int(info['nfev'])
+    residual = np.sum((dataY - model.function(dataX, *parameters))**2)
+    return FitResult(parameters, covariance, float(residual), int(info['nfev']))
+
+class BatchFitResult(NamedTuple):
+    '''
+    Result of fit_batch, one row per fit: parameters, their standard errors, sum of squares residual, whether the fit
+    converged, and the number of iterations of the whole batch.
+    '''
+    parameters: np.ndarray
+    errors: np.ndarray
+    residual: np.ndarray
+    converged: np.ndarray
+    iterations: int
+
+def fit_batch(model, dataX, dataY, p0, weights=None, fixed=(), max_iterations=100, tolerance=1e-10):
+    '''
+    Fits a model to every row of dataX and dataY at once with a vectorized Levenberg-Marquardt solver, using the model's
+    analytic Jacobian. All rows share one sample count; samples with zero weight are ignored. p0 holds one row of
+    starting parameters per fit, and parameters whose indices are in fixed keep their starting value.
+    '''
+    model = get_model(model)
+    dataX = np.atleast_2d(np.asarray(dataX, dtype=float))
+    dataY = np.atleast_2d(np.asarray(dataY, dtype=float))
+    parameters = np.array(p0, dtype=float, ndmin=2)
+    weights = np.ones_like(dataY) if weights is None else np.broadcast_to(weights, dataY.shape)
+    rows, count = parameters.shape
+    free = np.ones(count, dtype=bool)
+    free[list(fixed)] = False
+    diagonal = np.arange(count)
+
+    def residuals(parameters):
+        with np.errstate(all='ignore'):
+            values = (model.function(dataX, *parameters.T[:, :, None]) - dataY) * weights
+        cost = np.sum(values**2, axis=1)
+        return values, np.where(np.isfinite(cost), cost, np.inf)
+
+    values, cost = residuals(parameters)
+    damping = np.full(rows, 1e-3)
+    converged = np.zeros(rows, dtype=bool)
+    active = np.isfinite(cost)
+    iterations = 0
+    with stage('fit_batch', model=model.name, rows=rows, points=dataX.shape[1]) as timing:
+        while active.any() and iterations < max_iterations:
+            iterations += 1
+            with np.errstate(all='ignore'):
+                jacobian = model.jacobian(dataX, *parameters.T[:, :, None]) * weights[..., None]
+            jacobian[..., ~free] = 0
+            normal = np.einsum('rmi,rmj->rij', jacobian, jacobian)
+            gradient = np.einsum('rmi,rm->ri', jacobian, values)
+
+            #Marquardt scaling of the diagonal, fixed parameters get a unit diagonal and a zero gradient
+            damped = normal.copy()
+            damped[:, diagonal, diagonal] += damping[:, None] * np.maximum(normal[:, diagonal, diagonal], 1e-300)
+            damped[:, ~free, ~free] = 1
+            damped[~np.isfinite(damped).all(axis=(1, 2))] = np.eye(count)
+            step = -np.linalg.solve(damped, np.nan_to_num(gradient)[..., None])[..., 0]
+
+            trial = parameters + step
+            trial_values, trial_cost = residuals(trial)
+            better = active & (trial_cost < cost)
+            improvement = np.where(better, cost - trial_cost, 0)
+            parameters = np.where(better[:, None], trial, parameters)
+            values = np.where(better[:, None], trial_values, values)
+
+            #Converged once a step no longer changes the cost or the parameters noticeably
+            small_step = np.all(np.abs(step) <= tolerance * (np.abs(parameters) + tolerance), axis=1)
+            converged |= active & ((better & (improvement <= tolerance * cost)) | small_step)
+            cost = np.where(better, trial_cost, cost)
+            damping = np.where(better, damping / 3, damping * 2)
+            active &= ~converged & (damping < 1e12)
+        timing['iterations'] = iterations
+
+    #Standard errors from the undamped normal matrix at the solution, scaled by the residual variance
+    with np.errstate(all='ignore'):
+        jacobian = model.jacobian(dataX, *parameters.T[:, :, None]) * weights[..., None]
+    jacobian[..., ~free] = 0
+    normal = np.nan_to_num(np.einsum('rmi,rmj->rij', jacobian, jacobian))
+    degrees = np.maximum(np.count_nonzero(weights, axis=1) - np.count_nonzero(free), 1)
+    covariance = np.linalg.pinv(normal)
+    errors = np.sqrt(np.abs(covariance[:, diagonal, diagonal]) * (cost / degrees)[:, None])
+    errors[:, ~free] = 0
+    return BatchFitResult(parameters, errors, cost, converged, iterations)
+
+class ResonanceFitResult(NamedTuple):
+    '''
+    Result of fit_resonances, one entry per resonance: fitted position (nm), full width at half maximum (nm), loaded
+    quality factor, fitted parameters and their standard errors, and whether the fit converged.
+    '''
+    model: str
+    positions: np.ndarray
+    linewidths: np.ndarray
+    Q: np.ndarray
+    parameters: np.ndarray
+    errors: np.ndarray
+    converged: np.ndarray
+
+@memoize()
+def fit_resonances(data, model='lorentzian', prominence=3, kind='dip', window=3, preprocessing=None):
+    '''
+    Detects every resonance with find_resonances and fits model to all of them as one batch on the linear power (uW).
+    Each resonance is fitted over window times the median detected linewidth on either side, limited to half the
+    distance to its neighbours. For the airy model the FSR is fixed at the local spacing of the resonances.
+    preprocessing settings only apply to the detection, the fits use the measured spectrum so smoothing does not
+    broaden the linewidths.
+    '''
+    model = get_model(model)
+    if model.linewidth is None:
+        raise ValueError(f"{model.name} is not a resonance model")
+    spectrum = as_spectrum(data)
+    resonances = find_resonances(spectrum, prominence=prominence, kind=kind, preprocessing=preprocessing)
+    empty = np.empty(0)
+    if len(resonances.positions) == 0:
+        return ResonanceFitResult(model.name, empty, empty, empty, np.empty((0, len(model.parameters))),
+                                  np.empty((0, len(model.parameters))), np.empty(0, dtype=bool))
+
+    #One sample window per resonance, all of the same length so they can be stacked
+    dataX = spectrum.wavelength
+    spacing = abs(dataX[-1] - dataX[0]) / (len(dataX) - 1)
+    half = window * np.median(resonances.widths) / spacing
+    if len(resonances.positions) > 1:
+        half = min(half, np.min(resonances.FSR) / spacing / 2)
+    half = max(int(half), 4)
+    centers = np.searchsorted(dataX, resonances.positions)
+    index = centers[:, None] + np.arange(-half, half + 1)
+    inside = (index >= 0) & (index < len(dataX))
+    index = np.clip(index, 0, len(dataX) - 1)
+    windowX = dataX[index]
+    windowY = spectrum.linear[index]
+
+    #Neighbouring resonances give the local FSR, a lone one gets a broad FSR that leaves the dip Lorentzian-like
+    if len(resonances.positions) > 1:
+        FSR = np.gradient(resonances.positions)
+    else:
+        FSR = np.array([40 * max(resonances.widths[0], spacing)])
+    p0 = model.guess(windowX, windowY, FSR=FSR)
+    fixed = (model.parameters.index('FSR'),) if 'FSR' in model.parameters else ()
+
+    #The fit is better conditioned for offsets from each window's center than for absolute wavelengths
+    origin = windowX[:, half:half + 1]
+    if 'center' in model.parameters:
+        position = model.parameters.index('center')
+        p0[:, position] -= origin[:, 0]
+    result = fit_batch(model, windowX - origin, windowY, p0, weights=inside.astype(float), fixed=fixed)
+    parameters = result.parameters
+    if 'center' in model.parameters:
+        parameters[:, position] += origin[:, 0]
+    linewidths = np.abs(model.linewidth(*parameters.T))
+    positions = parameters[:, position] if 'center' in model.parameters else resonances.positions
+    return ResonanceFitResult(model.name, positions, linewidths, positions / linewidths, parameters, result.errors,
+                              result.converged)
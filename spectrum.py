@@ -0,0 +1,218 @@
+import hashlib
+import os
+
+import numpy as np
+
+from import_cache import import_cache, read_csv_arrays
+from instrumentation import stage
+from streaming import read_window
+
+def ascending(wavelength, power):
+    '''
+    Returns wavelength and power in order of increasing wavelength. Ascending sweeps are returned as they are,
+    descending ones reversed and unordered samples sorted.
+    '''
+    if len(wavelength) > 1 and not np.all(wavelength[1:] >= wavelength[:-1]):
+        if np.all(wavelength[1:] <= wavelength[:-1]):
+            order = slice(None, None, -1)
+        else:
+            order = np.argsort(wavelength, kind='stable')
+        wavelength = np.ascontiguousarray(wavelength[order])
+        power = np.ascontiguousarray(power[order])
+    return wavelength, power
+
+def window_slice(wavelength, start, end):
+    '''
+    Returns the slice of an increasing wavelength array with start < wavelength < end in O(log n).
+    '''
+    first = np.searchsorted(wavelength, start, side='right')
+    last = np.searchsorted(wavelength, end, side='left')
+    return slice(first, max(first, last))
+
+def to_linear(power):
+    '''
+    Converts power in dBm to microwatts.
+    '''
+    return 10 ** (power / 10) * 1000
+
+def normalize(linear):
+    '''
+    Normalizes linear power to the range [-1, 1] along the last axis.
+    '''
+    return linear / np.max(linear, axis=-1, keepdims=True) * 2 - 1
+
+class Spectrum:
+    '''
+    Container for a single spectral response. Wavelength (nm) and power (dBm) are parsed once into contiguous float64
+    arrays, and the linear (uW) and normalized views are computed on first use and cached.
+    Wavelengths are kept in increasing order, so wavelength windows are found by binary search and returned as slices
+    that share memory with the spectrum.
+    '''
+    __slots__ = ('wavelength', 'power', 'label', '_linear', '_normalized', '_hash')
+
+    def __init__(self, wavelength, power, label='', content_hash=None):
+        wavelength = np.ascontiguousarray(wavelength, dtype=np.float64)
+        power = np.ascontiguousarray(power, dtype=np.float64)
+        if wavelength.shape != power.shape or wavelength.ndim != 1:
+            raise ValueError("Wavelength and power must be one dimensional arrays of equal length")
+
+        #Descending sweeps are reversed and unordered samples sorted once, so windows can use searchsorted
+        wavelength, power = ascending(wavelength, power)
+
+        #Cached views are only valid as long as the underlying data does not change. The flags are set on views so the
+        #caller's arrays stay writable
+        self.wavelength = wavelength.view()
+        self.power = power.view()
+        self.wavelength.setflags(write=False)
+        self.power.setflags(write=False)
+        self.label = label
+        self._linear = None
+        self._normalized = None
+
+        #A digest already known for these samples, e.g. from a workspace file, saves hashing them again
+        self._hash = content_hash
+
+    @classmethod
+    def from_dataframe(cls, data, label=''):
+        '''
+        Builds a spectrum from a DataFrame read with header=None, skipping the header row.
+        '''
+        with stage('array_conversion', rows=len(data) - 1):
+            values = data.iloc[1:, :2].to_numpy(dtype=np.float64)
+        return cls(values[:, 0], values[:, 1], label)
+
+    @classmethod
+    def from_csv(cls, path, label='', cache=import_cache):
+        '''
+        Reads a two column wavelength/power csv file with a header row. Unless cache is None, the parsed arrays are
+        memory mapped from a binary sidecar when the file has been imported before.
+        '''
+        values = read_csv_arrays(path) if cache is None else cache.load(path)
+        return cls(values[0], values[1], label)
+
+    @property
+    def linear(self):
+        '''
+        Power in microwatts.
+        '''
+        if self._linear is None:
+            with stage('linearize', points=len(self.power)):
+                self._linear = to_linear(self.power)
+            self._linear.setflags(write=False)
+        return self._linear
+
+    @property
+    def normalized(self):
+        '''
+        Linear power normalized to the range [-1, 1].
+        '''
+        if self._normalized is None:
+            linear = self.linear
+            with stage('normalize', points=len(linear)):
+                self._normalized = normalize(linear)
+            self._normalized.setflags(write=False)
+        return self._normalized
+
+    @property
+    def content_hash(self):
+        '''
+        Digest of the wavelength and power data, identical for spectra with identical samples.
+        '''
+        if self._hash is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(self.wavelength.tobytes())
+            digest.update(self.power.tobytes())
+            self._hash = digest.hexdigest()
+        return self._hash
+
+    def views(self):
+        '''
+        Returns the arrays held by the spectrum by name. Derived views are only included once they have been computed.
+        '''
+        views = {'wavelength': self.wavelength, 'power': self.power}
+        if self._linear is not None:
+            views['linear'] = self._linear
+        if self._normalized is not None:
+            views['normalized'] = self._normalized
+        return views
+
+    def window_slice(self, start, end):
+        '''
+        Returns the slice of samples with start < wavelength < end in O(log n).
+        '''
+        return window_slice(self.wavelength, start, end)
+
+    def window(self, start, end):
+        '''
+        Returns the wavelength and power (dBm) inside start < wavelength < end as views into the spectrum.
+        '''
+        window = self.window_slice(start, end)
+        return self.wavelength[window], self.power[window]
+
+    def __len__(self):
+        return len(self.wavelength)
+
+    def __repr__(self):
+        return f'Spectrum({self.label!r}, {len(self)} points)'
+
+def as_spectrum(data, window=None):
+    '''
+    Accepts a Spectrum, a (wavelength, dBm) pair, a DataFrame as read by the application or a csv file path and returns
+    a Spectrum. For file paths, a (start, end) window streams in only the samples inside that wavelength range.
+    '''
+    if isinstance(data, Spectrum):
+        return data
+    if isinstance(data, tuple):
+        return Spectrum(data[0], data[1])
+    if isinstance(data, (str, os.PathLike)):
+        if window is None:
+            return Spectrum.from_csv(data, label=os.path.basename(data))
+        return Spectrum(*read_window(data, *window), label=os.path.basename(data))
+    return Spectrum.from_dataframe(data)
+
+class Workspace:
+    '''
+    Ordered collection of the loaded spectra, keyed by label. Spectra can also be added lazily, as a loader that is only
+    called when the spectrum is first accessed.
+    '''
+    def __init__(self):
+        self._spectra = {}
+
+    def add(self, spectrum):
+        '''
+        Adds a spectrum under its label, replacing any spectrum with the same label.
+        '''
+        self._spectra[spectrum.label] = spectrum
+        return spectrum
+
+    def add_lazy(self, label, loader):
+        '''
+        Adds a spectrum under label that is loaded by calling loader() on first access.
+        '''
+        self._spectra[label] = loader
+
+    def is_loaded(self, label):
+        return isinstance(self._spectra[label], Spectrum)
+
+    def labels(self):
+        return list(self._spectra)
+
+    def clear(self):
+        self._spectra.clear()
+
+    def __getitem__(self, label):
+        spectrum = self._spectra[label]
+        if not isinstance(spectrum, Spectrum):
+            spectrum = spectrum()
+            self._spectra[label] = spectrum
+        return spectrum
+
+    def __contains__(self, label):
+        return label in self._spectra
+
+    def __iter__(self):
+        for label in list(self._spectra):
+            yield self[label]
+
+    def __len__(self):
+        return len(self._spectra)
@@ -0,0 +1,115 @@
+import numpy as np
+
+from instrumentation import stage
+from preprocess import CHUNK_BYTES, preprocess_rows
+from spectra import common_grid, parabolic_offset, resample_many, xcorr_shifts
+from spectrum import normalize, to_linear, window_slice
+
+class SpectrumStack:
+    '''
+    Spectra resampled onto one shared, uniform wavelength grid as a single contiguous (spectra, points) array of dBm
+    power. Comparisons across spectra, such as normalization, window minima and differences, run as one vectorized
+    operation over the whole stack instead of a loop over spectra. The linear and normalized views are computed on first
+    use and cached.
+    '''
+    def __init__(self, grid, power, labels=None):
+        self.grid = np.asarray(grid, dtype=np.float64)
+        self.power = np.ascontiguousarray(power)
+        if self.power.ndim != 2 or self.power.shape[1] != len(self.grid):
+            raise ValueError("Power must be a two dimensional array with one column per grid point")
+        self.labels = list(labels) if labels is not None else [str(index) for index in range(len(self.power))]
+        self._linear = None
+        self._normalized = None
+
+    @classmethod
+    def from_spectra(cls, spectra, start=None, end=None, points=None, dtype=np.float64):
+        '''
+        Resamples spectra onto a common grid covering their overlap, optionally limited to [start, end]. The grid has
+        the finest median sample spacing among the spectra unless points is given, in which case only a few samples of
+        each spectrum are looked at, e.g. for a preview. float32 halves the memory of large stacks.
+        '''
+        spectra = list(spectra)
+        grid = common_grid(spectra, start, end, points)
+        return cls(grid, resample_many(spectra, grid, dtype), [spectrum.label for spectrum in spectra])
+
+    @property
+    def step(self):
+        return (self.grid[-1] - self.grid[0]) / (len(self.grid) - 1)
+
+    @property
+    def linear(self):
+        '''
+        Power in microwatts.
+        '''
+        if self._linear is None:
+            with stage('linearize', spectra=len(self), points=len(self.grid)):
+                self._linear = to_linear(self.power)
+        return self._linear
+
+    @property
+    def normalized(self):
+        '''
+        Linear power of each spectrum normalized to the range [-1, 1].
+        '''
+        if self._normalized is None:
+            linear = self.linear
+            with stage('normalize', spectra=len(self), points=len(self.grid)):
+                self._normalized = normalize(linear)
+        return self._normalized
+
+    def preprocessed(self, settings, chunk_bytes=CHUNK_BYTES):
+        '''
+        Returns a new stack with every spectrum smoothed and its baseline removed in one vectorized pass, a block of
+        spectra at a time for stacks larger than chunk_bytes.
+        '''
+        return SpectrumStack(self.grid, preprocess_rows(self.power, settings, chunk_bytes=chunk_bytes), self.labels)
+
+    def window_slice(self, start, end):
+        '''
+        Returns the slice of grid points with start < wavelength < end.
+        '''
+        return window_slice(self.grid, start, end)
+
+    def minima(self, start=None, end=None):
+        '''
+        Returns the wavelength and power of the lowest point of every spectrum inside start < wavelength < end, refined
+        to sub-sample precision by parabolic interpolation.
+        '''
+        window = self.window_slice(-np.inf if start is None else start, np.inf if end is None else end)
+        grid = self.grid[window]
+        power = self.power[:, window]
+        if power.shape[1] == 0:
+            raise ValueError("Window contains no samples")
+        with stage('peak_search', analysis='stack_minima', spectra=len(self)):
+            index = np.argmin(power, axis=1)
+            rows = np.arange(len(power))
+            if power.shape[1] < 3:
+                return grid[index], power[rows, index]
+            inner = np.clip(index, 1, power.shape[1] - 2)
+            offset, minimum = parabolic_offset(power[rows, inner - 1], power[rows, inner], power[rows, inner + 1])
+        return grid[0] + (inner + offset) * self.step, minimum
+
+    def differences(self, reference=0):
+        '''
+        Returns the power of every spectrum minus that of spectrum reference, in dB.
+        '''
+        return self.power - self.power[reference]
+
+    def shifts(self, start=None, end=None, reference=0, method='minimum', max_shift=None):
+        '''
+        Returns the shift in nm of every spectrum relative to spectrum reference inside [start, end]. With
+        method='minimum' it is the distance between the window minima, with method='xcorr' it is estimated by FFT
+        cross-correlation of the whole window, and NaN where the correlation peak lies beyond the lags searched.
+        '''
+        if method == 'xcorr':
+            window = self.window_slice(-np.inf if start is None else start, np.inf if end is None else end)
+            power = self.power[:, window].astype(np.float64, copy=False)
+            return xcorr_shifts(power[reference], power, self.step, max_shift)
+        positions, _ = self.minima(start, end)
+        return positions - positions[reference]
+
+    def __len__(self):
+        return len(self.power)
+
+    def __repr__(self):
+        return f'SpectrumStack({len(self)} spectra, {len(self.grid)} points, {self.power.dtype})'
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+from instrumentation import stage
+
+#Rows parsed per chunk, about 16 MB of float64 wavelength/power pairs
+CHUNK_ROWS = 1_000_000
+
+def read_chunks(path, chunksize=CHUNK_ROWS):
+    '''
+    Used to read a csv spectrum as (wavelength, power) chunks without loading the whole file.
+    '''
+    import pandas as pd
+
+    reader = pd.read_csv(path, sep=',', skiprows=1, skip_blank_lines=True, header=None, usecols=[0, 1],
+                         dtype=np.float64, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            values = chunk.to_numpy()
+            yield values[:, 0], values[:, 1]
+
+def read_window(path, start, end, chunksize=CHUNK_ROWS, stop_early=True):
+    '''
+    Used to read only the samples with start < wavelength < end. With stop_early, a monotonic sweep stops being read
+    past the window; pass stop_early=False for files holding several sweeps in the same direction.
+    '''
+    with stage('csv_stream_window', path=path, start=start, end=end):
+        return _read_window(path, start, end, chunksize, stop_early)
+
+def _last_wavelength(path, tail=4096):
+    '''
+    Returns the wavelength of the last row of a csv file from its final bytes, or None if it cannot be parsed.
+    '''
+    with open(path, 'rb') as file:
+        file.seek(max(0, os.path.getsize(path) - tail))
+        lines = [line for line in file.read().splitlines() if line.strip()]
+    try:
+        return float(lines[-1].split(b',')[0])
+    except (IndexError, ValueError):
+        return None
+
+def _direction(wavelength):
+    '''
+    Returns 1 for a non-decreasing, -1 for a non-increasing and 0 for a non-monotonic array.
+    '''
+    steps = np.diff(wavelength)
+    if np.all(steps >= 0):
+        return 1
+    if np.all(steps <= 0):
+        return -1
+    return 0
+
+def _read_window(path, start, end, chunksize, stop_early):
+    wavelength_pieces = []
+    power_pieces = []
+    direction = None if stop_early else 0
+    previous = None
+    for wavelength, power in read_chunks(path, chunksize):
+        if len(wavelength) == 0:
+            continue
+
+        #The sweep direction has to hold inside every chunk and across the boundary with the one before it
+        if direction != 0:
+            edges = wavelength if previous is None else np.concatenate(([previous], wavelength))
+            chunk_direction = _direction(edges)
+            if direction is None:
+                direction = chunk_direction
+            elif chunk_direction != direction and len(edges) > 1 and edges[-1] != edges[0]:
+                direction = 0
+        previous = wavelength[-1]
+        if (direction == 1 and wavelength[0] >= end) or (direction == -1 and wavelength[0] <= start):
+            #A file whose last sample is back inside or before the window turns around somewhere later on
+            last = _last_wavelength(path)
+            if last is not None and ((direction == 1 and last >= wavelength[0]) or
+                                     (direction == -1 and last <= wavelength[0])):
+                break
+            direction = 0
+
+        inside = (wavelength > start) & (wavelength < end)
+        if inside.any():
+            wavelength_pieces.append(wavelength[inside])
+            power_pieces.append(power[inside])
+
+    if not wavelength_pieces:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(wavelength_pieces), np.concatenate(power_pieces)
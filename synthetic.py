@@ -0,0 +1,48 @@
+'''
+Synthetic spectra for benchmarks and for exercising the application without an instrument.
+'''
+import numpy as np
+
+from spectrum import Spectrum
+
+def _to_dbm(linear, noise, rng):
+    '''
+    Converts a normalized transmission to dBm at 1 mW input and adds Gaussian noise in dB.
+    '''
+    power = 10 * np.log10(np.maximum(linear, 1e-12) / 1000)
+    if noise > 0:
+        power += rng.normal(0, noise, len(power))
+    return power
+
+def mzi_spectrum(points=100_000, start=1480, end=1515, FSR=3.0, phase=0.0, extinction=0.9, shift=0.0, noise=0.05,
+                 seed=None, label='MZI'):
+    '''
+    Cosine fringes of a Mach-Zehnder interferometer. extinction sets the fringe visibility, shift moves the fringes in
+    nm and noise is the standard deviation in dB.
+    '''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(start, end, points)
+    linear = 0.5 * (1 + extinction * np.cos(2 * np.pi / FSR * (wavelength - shift) + phase))
+    return Spectrum(wavelength, _to_dbm(linear, noise, rng), label)
+
+def ring_spectrum(points=100_000, start=1480, end=1515, FSR=2.0, first=1480.3, loss=0.98, coupling=0.985, shift=0.0,
+                  noise=0.05, seed=None, label='Ring'):
+    '''
+    Through port of an all-pass ring resonator with round trip amplitude transmission loss and self coupling coupling.
+    The first resonance sits at first + shift nm.
+    '''
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(start, end, points)
+    phi = 2 * np.pi * (wavelength - first - shift) / FSR
+    cos_phi = np.cos(phi)
+    linear = (loss**2 - 2 * loss * coupling * cos_phi + coupling**2) / (1 - 2 * loss * coupling * cos_phi
+                                                                        + (loss * coupling)**2)
+    return Spectrum(wavelength, _to_dbm(linear, noise, rng), label)
+
+def write_csv(spectrum, path):
+    '''
+    Writes a spectrum in the two column csv layout the application imports.
+    '''
+    with open(path, 'w') as file:
+        file.write('Wavelength (nm),Power (dBm)\n')
+        np.savetxt(file, np.column_stack((spectrum.wavelength, spectrum.power)), delimiter=',', fmt='%.6f')
@@ -0,0 +1,167 @@
+import numpy as np
+
+from spectra import common_grid, find_resonances, resample, resample_many, xcorr_shifts
+from spectrum import Spectrum, as_spectrum
+
+class ThermalSweep:
+    '''
+    Tracks every resonance across an ordered series of spectra taken at different temperatures and fits the position of
+    each one against temperature (nm/°C).
+
+    The first spectrum fixes the wavelength grid and the resonances to follow. Each later spectrum is compared with the
+    one before it only: a global cross-correlation shift moves each resonance's window along, and a cross-correlation of
+    that window gives the resonance's step. Appending a spectrum therefore costs the same however long the series is,
+    and the slope fits are kept as running sums.
+    '''
+    def __init__(self, start=None, end=None, prominence=3, kind='dip', max_step=None):
+        self.start = start
+        self.end = end
+        self.prominence = prominence
+        self.kind = kind
+        self.max_step = max_step
+        self.grid = None
+        self.reference = None
+        self.window = 0
+        self.temperatures = []
+        self._positions = []
+        self._offsets = []
+        self._last_row = None
+
+        #Running sums for the least squares slope of every resonance
+        self._count = None
+        self._sum_t = None
+        self._sum_tt = None
+        self._sum_p = None
+        self._sum_tp = None
+
+    def __len__(self):
+        return len(self.temperatures)
+
+    def _start(self, spectrum, temperature):
+        '''
+        Sets up the grid and the tracked resonances from the first spectrum.
+        '''
+        self.grid = common_grid([spectrum], self.start, self.end)
+        row = resample(spectrum, self.grid)
+        band = Spectrum(self.grid, row)
+        self.reference = find_resonances(band, prominence=self.prominence, kind=self.kind).positions
+        if len(self.reference) == 0:
+            raise ValueError("No resonances found in the first spectrum")
+
+        #Each resonance is followed in a window of half the smallest spacing between resonances
+        step = self.grid[1] - self.grid[0]
+        spacing = np.min(np.diff(self.reference)) if len(self.reference) > 1 else (self.grid[-1] - self.grid[0]) / 2
+        self.window = max(int(spacing / step / 2), 8)
+        if self.max_step is None:
+            self.max_step = spacing / 4
+
+        self._positions = [self.reference.copy()]
+        self._offsets = [0.0]
+        self._last_row = row
+        self._count, self._sum_t, self._sum_tt, self._sum_p, self._sum_tp = np.zeros((5, len(self.reference)))
+        self._add_to_fit(temperature, self.reference)
+
+    def _add_to_fit(self, temperature, positions):
+        self.temperatures.append(temperature)
+
+        #Resonances that drifted out of the band are NaN from then on and leave their fit as it was
+        tracked = np.isfinite(positions)
+        self._count += tracked
+        self._sum_t += tracked * temperature
+        self._sum_tt += tracked * temperature**2
+        self._sum_p += np.where(tracked, positions, 0)
+        self._sum_tp += np.where(tracked, temperature * positions, 0)
+
+    def _windows(self, rows, centers):
+        '''
+        Gathers a window around each center (nm) from each row. Windows near the ends of the band are moved inside it,
+        so every window holds measured samples only. Returns an array of shape (rows, centers, window).
+        '''
+        step = self.grid[1] - self.grid[0]
+        half = self.window // 2
+        middle = np.rint((centers - self.grid[0]) / step).astype(int)
+        first = np.clip(middle - half, 0, max(len(self.grid) - 2 * half - 1, 0))
+        index = np.minimum(first[..., None] + np.arange(2 * half + 1), len(self.grid) - 1)
+        return np.take_along_axis(rows[:, None, :], index, axis=2)
+
+    def _steps(self, previous, rows):
+        '''
+        Tracks the resonances through consecutive rows, where previous is the row before rows[0], and returns the
+        global offsets and resonance positions after each row.
+        '''
+        step = self.grid[1] - self.grid[0]
+        before = np.vstack((previous[None, :], rows[:-1]))
+
+        #Global shift between consecutive spectra, vectorized over the whole batch
+        global_steps = xcorr_shifts(before, rows, step, self.max_step)
+        if np.isnan(global_steps).any():
+            raise ValueError(f"Spectrum shifted by more than max_step ({self.max_step:.3g} nm) from the one before it")
+        offsets = self._offsets[-1] + np.cumsum(global_steps)
+
+        #Refine each resonance in a window that follows the global shift
+        centers = self.reference[None, :] + np.concatenate(([self._offsets[-1]], offsets[:-1]))[:, None]
+        resonances = len(self.reference)
+        window_before = self._windows(before, centers).reshape(len(rows) * resonances, -1)
+        window_after = self._windows(rows, centers).reshape(len(rows) * resonances, -1)
+        resonance_steps = xcorr_shifts(window_before, window_after, step, self.max_step).reshape(len(rows), resonances)
+
+        #A resonance that drifted out of the band is lost, the NaN carries through the cumulative sum
+        resonance_steps[(centers < self.grid[0]) | (centers > self.grid[-1])] = np.nan
+        positions = self._positions[-1] + np.cumsum(resonance_steps, axis=0)
+        return offsets, positions
+
+    def append(self, data, temperature):
+        '''
+        Adds the next spectrum of the series and updates the tracked positions and slopes.
+        '''
+        self.extend([data], [temperature])
+
+    def extend(self, spectra, temperatures):
+        '''
+        Adds several spectra at once. Their steps are tracked in one vectorized pass.
+        '''
+        spectra = [as_spectrum(data) for data in spectra]
+        if len(spectra) != len(temperatures):
+            raise ValueError("Every spectrum needs a temperature")
+        if len(spectra) == 0:
+            return
+        if self.grid is None:
+            self._start(spectra[0], temperatures[0])
+            spectra = spectra[1:]
+            temperatures = temperatures[1:]
+            if len(spectra) == 0:
+                return
+
+        rows = resample_many(spectra, self.grid)
+        offsets, positions = self._steps(self._last_row, rows)
+        self._offsets.extend(offsets)
+        self._positions.extend(positions)
+        self._last_row = rows[-1]
+        for temperature, position in zip(temperatures, positions):
+            self._add_to_fit(temperature, position)
+
+    @property
+    def positions(self):
+        '''
+        Resonance positions in nm, one row per spectrum and one column per resonance.
+        '''
+        return np.array(self._positions)
+
+    @property
+    def shifts(self):
+        '''
+        Resonance shifts in nm relative to the first spectrum.
+        '''
+        return self.positions - self.reference
+
+    @property
+    def slopes(self):
+        '''
+        Least squares slope of each resonance position against temperature in nm/°C, over the spectra in which the
+        resonance was tracked.
+        '''
+        n = self._count
+        denominator = n * self._sum_tt - self._sum_t**2
+        valid = (n >= 2) & (denominator > 0)
+        numerator = n * self._sum_tp - self._sum_t * self._sum_p
+        return np.divide(numerator, denominator, out=np.full(len(n), np.nan), where=valid)
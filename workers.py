@@ -0,0 +1,51 @@
+import traceback
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+class WorkerSignals(QObject):
+    '''
+    Signals emitted by a Worker. They are delivered to slots on the GUI thread.
+    '''
+    result = pyqtSignal(object)
+    error = pyqtSignal(str, str)
+    finished = pyqtSignal()
+
+class TimingSignals(QObject):
+    '''
+    Carries stage timings recorded on any thread to the GUI thread.
+    '''
+    timing = pyqtSignal(dict)
+
+class Worker(QRunnable):
+    '''
+    Runs fn(*args, **kwargs) on a QThreadPool thread and reports back through signals. A cancelled worker that has not
+    started yet never runs, and the result of a running one is discarded. The pool does not delete workers, their
+    lifetime is that of the Python object, so the owner can still call tryTake on one that has finished.
+    '''
+    def __init__(self, description, fn, *args, **kwargs):
+        super().__init__()
+        self.description = description
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = WorkerSignals()
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as error:
+            #The traceback goes to the GUI with the message instead of to stderr
+            if not self.cancelled:
+                self.signals.error.emit(f'{self.description} failed: {error}', traceback.format_exc())
+        else:
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
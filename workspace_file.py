@@ -0,0 +1,233 @@
+'''
+Workspace files: the spectra, analysis windows and cached results of a session as .npy members of one zip container.
+'''
+import json
+import os
+import struct
+import threading
+import zipfile
+
+import numpy as np
+
+from instrumentation import stage
+from result_cache import result_cache
+from spectra import CurveFitResult, ShiftResult, FSRResult, ResonanceResult, ResonanceFitResult
+from spectrum import Spectrum
+
+FORMAT_VERSION = 1
+INDEX = 'workspace.json'
+
+#Analysis results that can be stored, by type name
+RESULT_TYPES = {cls.__name__: cls for cls in (CurveFitResult, ShiftResult, FSRResult, ResonanceResult,
+                                              ResonanceFitResult)}
+
+def _write_array(archive, name, array):
+    with archive.open(name, 'w', force_zip64=True) as file:
+        np.lib.format.write_array(file, np.ascontiguousarray(array), allow_pickle=False)
+
+def _as_key(value):
+    '''
+    Turns the lists of a JSON decoded result cache key back into tuples.
+    '''
+    if isinstance(value, list):
+        return tuple(_as_key(item) for item in value)
+    return value
+
+def _find_view(array, spectra):
+    '''
+    Returns [position, name] if array is one of the arrays held by one of spectra, so it does not have to be stored twice.
+    '''
+    for position, spectrum in enumerate(spectra):
+        for name, view in spectrum.views().items():
+            if array is view:
+                return [position, name]
+    return None
+
+def _result_entry(key, value, spectra, number):
+    '''
+    Describes a cached result for the index and returns it with the arrays to store, or (None, None) if the result
+    belongs to spectra outside the workspace or cannot be stored.
+    '''
+    function, data_keys, args, kwargs = key
+    if type(value).__name__ not in RESULT_TYPES:
+        return None, None
+    if any(kind != 'spectrum' or digest not in spectra for kind, digest in data_keys):
+        return None, None
+    hashes = [digest for _, digest in data_keys]
+
+    fields = {}
+    arrays = {}
+    for field, item in value._asdict().items():
+        if isinstance(item, np.ndarray):
+            view = _find_view(item, [spectra[digest] for digest in hashes])
+            if view is not None:
+                fields[field] = {'view': view}
+            else:
+                member = f'results/{number}/{field}.npy'
+                fields[field] = {'member': member}
+                arrays[member] = item
+        elif isinstance(item, tuple):
+            fields[field] = {'tuple': [element.item() if isinstance(element, np.generic) else element
+                                       for element in item]}
+        else:
+            fields[field] = {'value': item.item() if isinstance(item, np.generic) else item}
+    entry = {'function': function, 'spectra': hashes, 'args': args, 'kwargs': kwargs, 'type': type(value).__name__,
+             'fields': fields}
+
+    #Parameters that do not survive JSON, such as arbitrary objects, would not give the same key when read back
+    try:
+        if _as_key(json.loads(json.dumps(args))) != args or _as_key(json.loads(json.dumps(kwargs))) != kwargs:
+            return None, None
+        json.dumps(fields)
+    except (TypeError, ValueError):
+        return None, None
+    return entry, arrays
+
+def save_workspace(path, workspace, windows=None, cache=result_cache, compress=True):
+    '''
+    Used to save the spectra, analysis windows and cached results of a workspace. Uncompressed files are larger, but
+    their spectra are memory mapped when opened.
+    '''
+    spectra = list(workspace)
+    by_hash = {}
+    for spectrum in spectra:
+        by_hash.setdefault(spectrum.content_hash, spectrum)
+    index = {'version': FORMAT_VERSION, 'windows': windows or {}, 'spectra': [], 'results': []}
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+    #A failed save leaves the previous workspace file as it was
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with stage('workspace_save', spectra=len(spectra)), \
+                zipfile.ZipFile(temporary, 'w', compression, compresslevel=1 if compress else None) as archive:
+            for number, spectrum in enumerate(spectra):
+                member = f'spectra/{number}.npy'
+                _write_array(archive, member, np.stack((spectrum.wavelength, spectrum.power)))
+                index['spectra'].append({'label': spectrum.label, 'hash': spectrum.content_hash, 'member': member,
+                                         'points': len(spectrum)})
+
+            for key, value in cache.items():
+                entry, arrays = _result_entry(key, value, by_hash, len(index['results']))
+                if entry is None:
+                    continue
+                for member, array in arrays.items():
+                    _write_array(archive, member, array)
+                index['results'].append(entry)
+
+            #The index is small and read on every open, so it is never compressed
+            archive.writestr(zipfile.ZipInfo(INDEX), json.dumps(index), compress_type=zipfile.ZIP_STORED)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return len(index['spectra']), len(index['results'])
+
+class WorkspaceFile:
+    '''
+    Used to read spectra of an opened workspace on demand, restoring cached results once all their spectra are read.
+    '''
+    def __init__(self, path, cache=result_cache):
+        self.path = path
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._archive = zipfile.ZipFile(path)
+        index = json.loads(self._archive.read(INDEX))
+        if index.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported workspace file version {index.get('version')}")
+        self.windows = index['windows']
+        self.entries = index['spectra']
+        self._results = index['results']
+        self._loaded = {}
+        self._by_hash = {}
+
+    def labels(self):
+        return [entry['label'] for entry in self.entries]
+
+    @property
+    def compressed(self):
+        return any(self._archive.getinfo(entry['member']).compress_type != zipfile.ZIP_STORED for entry in self.entries)
+
+    def load(self, number):
+        '''
+        Returns spectrum number of the file, reading it on first use.
+        '''
+        with self._lock:
+            if number not in self._loaded:
+                entry = self.entries[number]
+                with stage('workspace_load', label=entry['label'], points=entry['points']):
+                    values = self._read(entry['member'])
+                spectrum = Spectrum(values[0], values[1], entry['label'], content_hash=entry['hash'])
+                self._loaded[number] = spectrum
+                self._by_hash.setdefault(entry['hash'], spectrum)
+                self._restore_results()
+            return self._loaded[number]
+
+    def _read(self, member):
+        info = self._archive.getinfo(member)
+        if info.compress_type == zipfile.ZIP_STORED:
+            return self._map(info)
+        with self._archive.open(info) as file:
+            return np.lib.format.read_array(file, allow_pickle=False)
+
+    def _map(self, info):
+        '''
+        Memory maps an uncompressed .npy member in place. Its data starts after the zip local file header, whose name and
+        extra field lengths can differ from the central directory, and the .npy header.
+        '''
+        with open(self.path, 'rb') as file:
+            file.seek(info.header_offset)
+            header = file.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            offset = file.tell()
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                         order='F' if fortran_order else 'C')
+
+    def _restore_results(self):
+        pending = []
+        for entry in self._results:
+            if all(digest in self._by_hash for digest in entry['spectra']):
+                self.cache.put(self._result_key(entry), self._result_value(entry))
+            else:
+                pending.append(entry)
+        self._results = pending
+
+    def _result_key(self, entry):
+        #Same layout as the keys built by result_cache.memoize
+        return (entry['function'], tuple(('spectrum', digest) for digest in entry['spectra']), _as_key(entry['args']),
+                _as_key(entry['kwargs']))
+
+    def _result_value(self, entry):
+        spectra = [self._by_hash[digest] for digest in entry['spectra']]
+        fields = {}
+        for field, stored in entry['fields'].items():
+            if 'view' in stored:
+                position, name = stored['view']
+                fields[field] = getattr(spectra[position], name)
+            elif 'member' in stored:
+                fields[field] = self._read(stored['member'])
+            elif 'tuple' in stored:
+                fields[field] = tuple(stored['tuple'])
+            else:
+                fields[field] = stored['value']
+        return RESULT_TYPES[entry['type']](**fields)
+
+    def close(self):
+        self._archive.close()
+
+def open_workspace(path, workspace, cache=result_cache):
+    '''
+    Used to replace the contents of workspace with lazily read spectra of a workspace file. Returns the WorkspaceFile.
+    '''
+    with stage('workspace_open', path=path):
+        file = WorkspaceFile(path, cache)
+    workspace.clear()
+    for number, label in enumerate(file.labels()):
+        workspace.add_lazy(label, lambda number=number: file.load(number))
+    return file